@@ -1,5 +1,7 @@
 import os
 
+from datetime import timedelta
+
 import djcelery
 
 from django.contrib import messages
@@ -58,6 +60,17 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'google_scraper.wsgi.application'
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'google_scraper_search_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -140,15 +153,43 @@ BROKER_URL = 'redis://localhost:6379/0'
 
 CELERY_SEND_EVENTS = True
 
+CELERY_TASK_SERIALIZER = 'json'
+
+CELERY_RESULT_SERIALIZER = 'json'
+
+CELERY_ACCEPT_CONTENT = ['json']
+
 CELERYBEAT_SCHEDULER = 'djcelery.schedulers.DatabaseScheduler'
 
 CELERY_ROUTES = {
-    'scraper.tasks._online_check_task': {'queue': 'google_scraper'},
-    'scraper.tasks._google_ban_check_task': {'queue': 'google_scraper'},
     'scraper.tasks._search_task': {'queue': 'google_scraper'},
     'scraper.tasks.online_check_task': {'queue': 'google_scraper'},
     'scraper.tasks.google_ban_check_task': {'queue': 'google_scraper'},
-    'scraper.tasks.search_task': {'queue': 'google_scraper'}
+    'scraper.tasks.search_task': {'queue': 'google_scraper_interactive'},
+    'scraper.tasks.dispatch_jobs_task': {
+        'queue': 'google_scraper_interactive'
+    },
+    'scraper.tasks.sync_scraper_count_task': {'queue': 'google_scraper'},
+    'scraper.tasks.minify_pages_task': {'queue': 'google_scraper'},
+    'scraper.tasks.country_check_task': {'queue': 'google_scraper'},
+    'scraper.tasks.bulk_import_task': {'queue': 'google_scraper'},
+    'scraper.tasks.collect_page_bodies_task': {'queue': 'google_scraper'},
+    'scraper.tasks.backfill_page_bodies_task': {'queue': 'google_scraper'}
+}
+
+CELERYBEAT_SCHEDULE = {
+    'sync_scraper_count': {
+        'task': 'scraper.tasks.sync_scraper_count_task',
+        'schedule': timedelta(minutes=1),
+    },
+    'dispatch_jobs': {
+        'task': 'scraper.tasks.dispatch_jobs_task',
+        'schedule': timedelta(minutes=1),
+    },
+    'collect_page_bodies': {
+        'task': 'scraper.tasks.collect_page_bodies_task',
+        'schedule': timedelta(days=1),
+    },
 }
 
 djcelery.setup_loader()
@@ -172,3 +213,104 @@ MAX_RETRY = 3
 MAX_PAGE = 3
 
 RESULT_PER_PAGE = 10
+
+USE_ASYNC_SCRAPER = True
+
+# searches in progress per task, most of them wait for their proxy's next
+# request slot on the event loop without holding a thread
+SCRAPER_CONCURRENCY = 200
+
+# threads running http requests, redis and database calls per task, this
+# bounds the requests in flight and the database connections of a task
+SCRAPER_THREADS = 20
+
+SCHEDULER_BURST = 1
+
+SCHEDULER_BAN_WINDOW = 24 * 60 * 60
+
+SCHEDULER_URL = BROKER_URL
+
+PROXY_LEASE_URL = BROKER_URL
+
+PROXY_LEASE_TTL = 2 * REQUEST_TIMEOUT
+
+PROXY_CANDIDATES = 100
+
+PROXY_POOL_URL = BROKER_URL
+
+PROXY_POOL_REFRESH = 5 * 60
+
+PROXY_POOL_FLUSH = 30
+
+ONLINE_CHECK_CONCURRENCY = 2000
+
+CHECK_CHUNK_SIZE = 1000
+
+CHECK_FD_HEADROOM = 100
+
+BAN_CHECK_CONCURRENCY = 200
+
+BAN_CHECK_TIMEOUT = 15
+
+TASK_CHUNK_SIZE = 500
+
+PARSER_BACKEND = 'lxml'
+
+PAGE_STORE_BACKEND = 'database'
+
+PAGE_STORE_ROOT = os.path.join(
+    os.path.dirname(os.path.dirname(BASE_DIR)), 'google_scraper_pages'
+)
+
+PAGE_CAPTURE_MODE = 'raw'
+
+PAGE_STORE_CHUNK_SIZE = 1000
+
+PAGE_BODY_GC_AGE = 24 * 60 * 60
+
+SESSION_POOL_SIZE = 500
+
+SESSION_POOL_MAXSIZE = 10
+
+SESSION_IDLE_TIMEOUT = 5 * 60
+
+PROXY_LATENCY_SMOOTHING = 0.3
+
+GEOIP_DATABASE = '/usr/local/share/GeoIP/GeoLiteCity.dat'
+
+SEARCH_CACHE = 'search'
+
+SEARCH_CACHE_TTL = 24 * 60 * 60
+
+PAGE_TRUNCATION_RATIO = 0.5
+
+JOB_QUEUE_URL = BROKER_URL
+
+JOB_QUEUES = {
+    'interactive': 'google_scraper_interactive',
+    'bulk': 'google_scraper',
+}
+
+JOB_INTERACTIVE_LIMIT = 100
+
+JOB_BULK_CONCURRENCY = 4
+
+JOB_INFLIGHT_TTL = 10 * 60
+
+JOB_HEARTBEAT_INTERVAL = 60
+
+JOB_WAIT_SAMPLES = 1000
+
+USER_AGENT_URL = BROKER_URL
+
+USER_AGENT_CHECK = 30
+
+USER_AGENT_REFRESH = 60 * 60
+
+USER_AGENT_STICKY_TTL = 30 * 60
+
+ADMIN_ESTIMATE_THRESHOLD = 100000
+
+EXPORT_CHUNK_SIZE = 5000
+
+IMPORT_CHUNK_SIZE = 10000
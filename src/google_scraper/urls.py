@@ -6,4 +6,9 @@ from scraper import views
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^html/(?P<pk>\d+)$', views.html_view, name='html'),
+    url(r'^jobs$', views.jobs_view, name='jobs'),
+    url(
+        r'^export\.(?P<export_format>csv|jsonl|parquet)$', views.export_view,
+        name='export'
+    ),
 ]
@@ -1,11 +1,18 @@
+from functools import lru_cache
+
 from import_export import resources
 from import_export.admin import ImportMixin
 
 from django.contrib import admin, messages
 from django.core.urlresolvers import reverse
 
+from .jobs import jobs
 from .models import UserAgent, Proxy, GoogleSearch, GooglePage, GoogleLink
-from .tasks import online_check_task, google_ban_check_task, search_task
+from .paginators import EstimatedCountPaginator
+from .tasks import (
+    online_check_task, google_ban_check_task, search_task, country_check_task
+)
+from .utils import compress_ids
 
 
 class UserAgentResource(resources.ModelResource):
@@ -25,9 +32,20 @@ class ProxyResource(resources.ModelResource):
         model = Proxy
         exclude = [
             'online', 'google_ban', 'date_online', 'date_google_ban', 'speed',
-            'country', 'scraper_count', 'date_added', 'date_updated'
+            'latency', 'country', 'scraper_count', 'date_added',
+            'date_updated'
         ]
 
+    def import_data(self, dataset, dry_run=False, raise_errors=False,
+                    use_transactions=None, **kwargs):
+        '''enrich imported proxies with country in one background task'''
+        result = super().import_data(
+            dataset, dry_run, raise_errors, use_transactions, **kwargs
+        )
+        if not dry_run and not result.has_errors():
+            country_check_task.delay()
+        return result
+
 
 class GoogleSearchResource(resources.ModelResource):
 
@@ -35,7 +53,40 @@ class GoogleSearchResource(resources.ModelResource):
 
     class Meta:
         model = GoogleSearch
-        exclude = ['success', 'date_updated', 'date_added']
+        exclude = [
+            'success', 'request_count', 'date_updated', 'date_added'
+        ]
+
+
+@lru_cache()
+def get_admin_url(name):
+    '''return admin url without arguments, reversed once'''
+    return reverse(name)
+
+
+@lru_cache()
+def get_admin_url_format(name):
+    '''return admin url with placeholder for object id, reversed once'''
+    head, tail = reverse(name, args=['0']).rsplit('/0/', 1)
+    return head + '/{}/' + tail
+
+
+def get_change_url(obj):
+    '''return admin change url of model instance'''
+    opts = obj._meta.concrete_model._meta
+    return get_admin_url_format(
+        'admin:{}_{}_change'.format(opts.app_label, opts.model_name)
+    ).format(obj.pk)
+
+
+def has_related(obj, name):
+    '''check once per instance if related objects exist'''
+    if obj is None:
+        return False
+    attr = '_has_{}'.format(name)
+    if not hasattr(obj, attr):
+        setattr(obj, attr, getattr(obj, name).exists())
+    return getattr(obj, attr)
 
 
 class ReadOnlyInline(admin.TabularInline):
@@ -54,20 +105,19 @@ class GooglePageInline(ReadOnlyInline):
     '''google page inlined to google search'''
 
     model = GooglePage
-    exclude = ['url', 'html', 'result_count', 'start', 'end', 'next_page']
+    exclude = [
+        'url', 'html', 'body', 'result_count', 'start', 'end', 'next_page'
+    ]
     readonly_fields = ['_url', 'date_added']
     extra = 0
     show_change_link = True
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('html')
+
     def _url(self, obj):
         '''google page change list url field'''
-        url = reverse(
-            'admin:{}_{}_change'.format(
-                obj._meta.app_label, obj._meta.model_name
-            ),
-            args=[obj.id]
-        )
-        return '<a href="{}">{}</a>'.format(url, obj.url)
+        return '<a href="{}">{}</a>'.format(get_change_url(obj), obj.url)
 
     _url.allow_tags = True
 
@@ -77,19 +127,13 @@ class GoogleLinkInline(ReadOnlyInline):
     '''Google link inlined to Google page'''
 
     model = GoogleLink
-    exclude = ['title', 'url', 'snippet']
+    exclude = ['search', 'title', 'url', 'snippet']
     readonly_fields = ['_title', '_url', 'rank', 'date_added']
     extra = 0
 
     def _title(self, obj):
         '''google link change list url field'''
-        url = reverse(
-            'admin:{}_{}_change'.format(
-                obj._meta.app_label, obj._meta.model_name
-            ),
-            args=[obj.id]
-        )
-        return '<a href="{}">{}</a>'.format(url, obj.title)
+        return '<a href="{}">{}</a>'.format(get_change_url(obj), obj.title)
 
     _title.allow_tags = True
 
@@ -118,7 +162,8 @@ class UserAgentAdmin(ImportMixin, admin.ModelAdmin):
 
     resource_class = UserAgentResource
     search_fields = ['string']
-    list_display = ['string', 'date_added']
+    list_display = ['string', 'weight', 'date_added']
+    list_editable = ['weight']
 
 
 @admin.register(Proxy)
@@ -129,26 +174,41 @@ class ProxyAdmin(ImportMixin, admin.ModelAdmin):
     resource_class = ProxyResource
     search_fields = ['__str__']
     list_display = [
-        '__str__', 'scraper_count', 'online', 'google_ban', 'speed', 'country',
-        'date_updated'
+        '__str__', 'protocol', 'scraper_count', 'online', 'google_ban',
+        'speed', 'latency', 'country', 'date_updated'
     ]
-    list_filter = ['online', 'google_ban']
+    list_filter = ['protocol', 'online', 'google_ban']
     actions = ['online_check_action', 'google_ban_check_action']
 
     def add_view(self, request, extra_content=None):
-        self.fieldsets = [[None, {'fields': ['host', 'port']}]]
+        self.fieldsets = [
+            [
+                None, {
+                    'fields': [
+                        'host', 'port', 'protocol', 'username', 'password'
+                    ]
+                }
+            ]
+        ]
         self.readonly_fields = []
         return super().add_view(request)
 
     def change_view(self, request, object_id, extra_content=None):
         self.fieldsets = [
-            [None, {'fields': ['host', 'port', 'scraper_count']}],
+            [
+                None, {
+                    'fields': [
+                        'host', 'port', 'protocol', 'username', 'password',
+                        'scraper_count'
+                    ]
+                }
+            ],
             [
                 'Status', {
                     'classes': ['collapse'],
                     'fields': [
-                        'online', 'google_ban', 'speed', 'date_online',
-                        'date_google_ban'
+                        'online', 'google_ban', 'speed', 'latency',
+                        'date_online', 'date_google_ban'
                     ]
                 }
             ],
@@ -156,14 +216,21 @@ class ProxyAdmin(ImportMixin, admin.ModelAdmin):
         ]
         self.readonly_fields = [
             'host', 'port', 'scraper_count', 'online', 'google_ban', 'speed',
-            'date_online', 'date_google_ban', 'country'
+            'latency', 'date_online', 'date_google_ban', 'country'
         ]
         return super().change_view(request, object_id)
 
+    def save_model(self, request, obj, form, change):
+        '''save proxy and look up its country'''
+        super().save_model(request, obj, form, change)
+        obj.country_check()
+
     def online_check_action(self, request, queryset):
         '''online check admin action'''
         count = queryset.count()
-        online_check_task.delay(queryset)
+        online_check_task.delay(
+            compress_ids(queryset.values_list('id', flat=True))
+        )
         if count == 1:
             part = '1 proxy'
         else:
@@ -180,7 +247,9 @@ class ProxyAdmin(ImportMixin, admin.ModelAdmin):
     def google_ban_check_action(self, request, queryset):
         '''google ban check admin action'''
         count = queryset.count()
-        google_ban_check_task.delay(queryset)
+        google_ban_check_task.delay(
+            compress_ids(queryset.values_list('id', flat=True))
+        )
         if count == 1:
             part = '1 proxy'
         else:
@@ -205,77 +274,69 @@ class GoogleSearchAdmin(ImportMixin, admin.ModelAdmin):
     list_display = ['q', '_results', 'result_count', 'success', 'date_updated']
     list_filter = ['success']
     actions = ['search_action']
+    inlines = [GooglePageInline]
 
-    def add_view(self, request, extra_content=None):
-        self.fieldsets = [
+    def get_fieldsets(self, request, obj=None):
+        fieldsets = [
             [None, {'fields': ['q']}],
             [
                 'Options', {
                     'classes': ['collapse'],
-                    'fields': ['cr', 'cd_min', 'cd_max']
+                    'fields': ['cr', 'cd_min', 'cd_max', 'depth']
                 }
             ]
         ]
-        self.readonly_fields = []
-        self.inlines = []
-        return super().add_view(request)
-
-    def change_view(self, request, object_id, extra_content=None):
-        self.fieldsets = [
-            [None, {'fields': ['q']}],
-            [
-                'Options', {
+        if has_related(obj, 'googlepage_set'):
+            fieldsets.append([
+                'Results', {
                     'classes': ['collapse'],
-                    'fields': ['cr', 'cd_min', 'cd_max']
+                    'fields': ['success', 'result_count', 'request_count']
                 }
+            ])
+        return fieldsets
+
+    def get_readonly_fields(self, request, obj=None):
+        if has_related(obj, 'googlepage_set'):
+            return [
+                'q', 'cr', 'cd_min', 'cd_max', 'depth', 'success',
+                'result_count', 'request_count'
             ]
-        ]
-        self.readonly_fields = []
-        self.inlines = []
-        obj = GoogleSearch.objects.get(id=object_id)
-        if obj.googlepage_set.count():
-            self.fieldsets = [
-                [None, {'fields': ['q']}],
-                [
-                    'Options', {
-                        'classes': ['collapse'],
-                        'fields': ['cr', 'cd_min', 'cd_max']
-                    }
-                ],
-                [
-                    'Results', {
-                        'classes': ['collapse'],
-                        'fields': ['success', 'result_count']
-                    }
-                ]
-            ]
-            self.readonly_fields = [
-                'q', 'cr', 'cd_min', 'cd_max', 'success', 'result_count'
-            ]
-            self.inlines = [GooglePageInline]
-        return super().change_view(request, object_id)
+        return []
+
+    def get_inline_instances(self, request, obj=None):
+        if has_related(obj, 'googlepage_set'):
+            return super().get_inline_instances(request, obj)
+        return []
 
     def search_action(self, request, queryset):
         '''google search admin action'''
-        queryset = queryset.exclude(success=True)
-        count = queryset.count()
-        search_task.delay(queryset)
-        if count == 1:
+        ids = list(queryset.exclude(success=True).values_list('id', flat=True))
+        inflight = jobs.get_inflight(ids)
+        ids = [pk for pk in ids if pk not in inflight]
+        if ids:
+            search_task.delay(
+                compress_ids(ids), batch='user:{}'.format(request.user.pk)
+            )
+        if len(ids) == 1:
             part = '1 search'
         else:
-            part = '{} searches'.format(count)
+            part = '{} searches'.format(len(ids))
+        if inflight:
+            part += ', skipped {} already queued or running'.format(
+                len(inflight)
+            )
         self.message_user(
             request,
             'Successfully launched search_task for ' + part,
-            level=messages.SUCCESS
+            level=messages.WARNING if inflight else messages.SUCCESS
         )
 
     search_action.short_description = 'Search Google for selected searches'
 
     def _results(self, obj):
         '''google link change list url filtered by search id'''
-        url = reverse('admin:scraper_googlelink_changelist') + \
-            '?page__search__id__exact={}'.format(obj.id)
+        url = get_admin_url('admin:scraper_googlelink_changelist') + \
+            '?search__id__exact={}'.format(obj.id)
         return '<a href="{0}">View all</a>'.format(url)
 
     _results.short_description = 'results'
@@ -289,6 +350,8 @@ class GooglePageAdmin(ReadOnlyAdmin):
 
     search_fields = ['url']
     list_display = ['url', 'result_count', 'date_added']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = [
         [
             None,
@@ -298,12 +361,10 @@ class GooglePageAdmin(ReadOnlyAdmin):
     readonly_fields = ['_url', '_html', 'result_count']
     inlines = [GoogleLinkInline]
 
-    def change_view(self, request, object_id, extra_content=None):
-        self.inlines = []
-        obj = GooglePage.objects.get(id=object_id)
-        if obj.googlelink_set.count():
-            self.inlines = [GoogleLinkInline]
-        return super().change_view(request, object_id)
+    def get_inline_instances(self, request, obj=None):
+        if has_related(obj, 'googlelink_set'):
+            return super().get_inline_instances(request, obj)
+        return []
 
     def _url(self, obj):
         '''search result page url field'''
@@ -327,13 +388,15 @@ class GoogleLinkAdmin(ReadOnlyAdmin):
 
     '''model admin for google link'''
 
-    search_fields = ['title']
+    search_fields = ['title', 'url', 'snippet']
     list_display = ['url', 'title', 'date_added']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = [[None, {'fields': ['_url', 'title', 'snippet', 'rank']}]]
     readonly_fields = ['_url', 'title', 'snippet', 'rank']
 
     def lookup_allowed(self, key, value):
-        if key in ['page__search__id__exact']:
+        if key in ['search__id__exact', 'page__search__id__exact']:
             return True
         return super().lookup_allowed(key, value)
 
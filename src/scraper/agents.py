@@ -0,0 +1,111 @@
+import bisect
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+import redis
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class UserAgentRotation(object):
+
+    '''per process weighted user agent list with sticky choice per proxy'''
+
+    key = 'google_scraper:user_agents:version'
+
+    def __init__(self, url=None):
+        self.url = url
+        self.reset()
+
+    def reset(self):
+        '''drop cached state, used on first use and after fork'''
+        self.pid = os.getpid()
+        self.lock = threading.RLock()
+        self.strings = []
+        self.cumulative = []
+        self.sticky = {}
+        self.version = None
+        self.date_loaded = None
+        self.date_checked = None
+        self._client = None
+
+    @property
+    def client(self):
+        '''lazily connected redis client'''
+        if not self._client:
+            self._client = redis.StrictRedis.from_url(
+                self.url or settings.USER_AGENT_URL
+            )
+        return self._client
+
+    def check(self):
+        '''reload user agents when version changed or list is too old'''
+        if self.pid != os.getpid():
+            self.reset()
+        now = time.monotonic()
+        if self.date_checked and \
+                now - self.date_checked < settings.USER_AGENT_CHECK:
+            return
+        self.date_checked = now
+        version = self.client.get(self.key)
+        if version != self.version or not self.date_loaded or \
+                now - self.date_loaded > settings.USER_AGENT_REFRESH:
+            self.load(version)
+
+    def load(self, version=None):
+        '''load user agent strings and cumulative weights from database'''
+        from .models import UserAgent
+        rows = UserAgent.objects.filter(weight__gt=0).values_list(
+            'string', 'weight'
+        )
+        strings = [string for string, weight in rows]
+        cumulative = list(itertools.accumulate(weight for _, weight in rows))
+        with self.lock:
+            self.strings = strings
+            self.cumulative = cumulative
+            self.sticky = {}
+            self.version = version
+            self.date_loaded = time.monotonic()
+        logger.debug('loaded {} user agents'.format(len(strings)))
+
+    def changed(self):
+        '''make every process reload user agents on next use'''
+        self.client.incr(self.key)
+        self.date_checked = None
+
+    def choose(self):
+        '''return weighted random user agent string'''
+        point = random.random() * self.cumulative[-1]
+        return self.strings[bisect.bisect(self.cumulative, point)]
+
+    def get(self, proxy=None):
+        '''return user agent string, kept per proxy for a while, or None'''
+        with self.lock:
+            self.check()
+            if not self.strings:
+                logger.info('no user agents in database')
+                return
+            if not proxy:
+                return self.choose()
+            now = time.monotonic()
+            string, expires = self.sticky.get(proxy.pk, (None, 0))
+            if not string or now > expires:
+                string = self.choose()
+                self.sticky[proxy.pk] = (
+                    string, now + settings.USER_AGENT_STICKY_TTL
+                )
+            return string
+
+
+user_agents = UserAgentRotation()
+
+
+def user_agents_changed(sender, **kwargs):
+    '''signal receiver for saved and deleted user agents'''
+    user_agents.changed()
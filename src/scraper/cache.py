@@ -0,0 +1,79 @@
+import hashlib
+import logging
+
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCache(object):
+
+    '''successful searches keyed by normalized query parameters'''
+
+    prefix = 'google_search:'
+
+    @property
+    def cache(self):
+        '''configured django cache backend'''
+        return caches[settings.SEARCH_CACHE]
+
+    def get_key(self, search):
+        '''return cache key for normalized search query parameters and depth'''
+        params = search.get_query_params()
+        params['q'] = ' '.join(params['q'].lower().split())
+        params['depth'] = search.depth or 0
+        query = urlencode(sorted(params.items())).encode('utf-8')
+        return self.prefix + hashlib.sha1(query).hexdigest()
+
+    def store(self, search):
+        '''remember successful search for cache ttl'''
+        if search.success:
+            self.cache.set(
+                self.get_key(search), search.pk, settings.SEARCH_CACHE_TTL
+            )
+
+    def restore(self, search):
+        '''copy results of cached search to search and return True on hit'''
+        from .models import GoogleSearch
+        key = self.get_key(search)
+        pk = self.cache.get(key)
+        if not pk or pk == search.pk:
+            return False
+        source = GoogleSearch.objects.filter(pk=pk, success=True).first()
+        if not source:
+            self.cache.delete(key)
+            return False
+        self.clone(source, search)
+        logger.info(
+            'restored google search {} from cached search {}'.format(
+                search, source.pk
+            )
+        )
+        return True
+
+    def clone(self, source, search):
+        '''copy pages and links of source search to search'''
+        from .models import GoogleLink
+        pages = source.googlepage_set.order_by('start').prefetch_related(
+            'googlelink_set'
+        )
+        with transaction.atomic():
+            search.googlepage_set.all().delete()
+            for page in pages:
+                links = list(page.googlelink_set.all())
+                page.pk = None
+                page.search = search
+                page.save()
+                for link in links:
+                    link.pk = None
+                    link.page = page
+                    link.search = search
+                GoogleLink.objects.bulk_create(links)
+            search.set_results(source.result_count, True)
+
+
+search_cache = SearchCache()
@@ -0,0 +1,224 @@
+import asyncio
+import errno
+import logging
+import random
+import resource
+import string
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import requests
+
+from django.conf import settings
+from django.db.models import (
+    Case, When, Value, F, DateTimeField, FloatField, NullBooleanField
+)
+from django.utils import timezone
+
+from .pool import proxy_pool
+
+logger = logging.getLogger(__name__)
+
+NOT_PROBED = object()
+
+# pieces of google's captcha interstitial, search results never contain them
+BAN_MARKERS = [b'/sorry/index', b'g-recaptcha']
+
+
+def is_banned(response):
+    '''check google response for refused status codes and captcha page'''
+    if response.status_code != 200:
+        return True
+    content = response.content.lower()
+    return any(marker in content for marker in BAN_MARKERS)
+
+
+def chunks(items, size):
+    '''yield successive lists of size items'''
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class OnlineChecker(object):
+
+    '''probe proxy ports concurrently with non-blocking connects'''
+
+    def __init__(self, concurrency=None, timeout=None):
+        self.concurrency = concurrency or settings.ONLINE_CHECK_CONCURRENCY
+        self.timeout = timeout or settings.PROXY_TIMEOUT
+
+    def get_concurrency(self):
+        '''return concurrency capped by open file limit minus headroom'''
+        limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if limit == resource.RLIM_INFINITY:
+            return self.concurrency
+        return max(
+            1, min(self.concurrency, limit - settings.CHECK_FD_HEADROOM)
+        )
+
+    async def probe(self, semaphore, host, port):
+        '''return connect time, None if closed or NOT_PROBED without fds'''
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                _, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, port), self.timeout
+                )
+            except asyncio.TimeoutError:
+                return
+            except OSError as e:
+                if e.errno in (errno.EMFILE, errno.ENFILE):
+                    return NOT_PROBED
+                return
+            writer.close()
+            return time.monotonic() - start
+
+    def probe_all(self, addresses):
+        '''return connect times for list of (host, port) pairs'''
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        semaphore = asyncio.Semaphore(self.get_concurrency())
+        try:
+            return loop.run_until_complete(
+                asyncio.gather(
+                    *[self.probe(semaphore, *address) for address in addresses]
+                )
+            )
+        finally:
+            loop.close()
+
+    def save(self, results):
+        '''write online status and speed with one update per chunk'''
+        from .models import Proxy
+        now = timezone.now()
+        for chunk in chunks(list(results.items()), settings.CHECK_CHUNK_SIZE):
+            online = [pk for pk, speed in chunk if speed is not None]
+            Proxy.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+                online=Case(
+                    When(pk__in=online, then=Value(True)),
+                    default=Value(False), output_field=NullBooleanField()
+                ),
+                speed=Case(
+                    *[
+                        When(pk=pk, then=Value(speed))
+                        for pk, speed in chunk if speed is not None
+                    ],
+                    default=None, output_field=FloatField()
+                ),
+                date_online=Case(
+                    When(pk__in=online, then=Value(now)),
+                    default=F('date_online'), output_field=DateTimeField()
+                ),
+                date_updated=now
+            )
+
+    def check(self, proxies):
+        '''probe proxies, store results and return online count'''
+        proxies = list(proxies.values_list('id', 'host', 'port'))
+        start = time.monotonic()
+        speeds = self.probe_all([(host, port) for _, host, port in proxies])
+        elapsed = time.monotonic() - start
+        results = {
+            pk: speed for (pk, _, _), speed in zip(proxies, speeds)
+            if speed is not NOT_PROBED
+        }
+        if len(results) < len(proxies):
+            logger.warning(
+                'skipped {} proxies for lack of file descriptors'.format(
+                    len(proxies) - len(results)
+                )
+            )
+        self.save(results)
+        proxy_pool.publish_reload()
+        online = len(
+            [speed for speed in results.values() if speed is not None]
+        )
+        logger.info(
+            'checked {} proxies in {:.1f} seconds, {:.1f} probes/second, {} '
+            'online'.format(
+                len(proxies), elapsed, len(proxies) / max(elapsed, 1e-6),
+                online
+            )
+        )
+        return online
+
+
+class BanProbe(object):
+
+    '''send one short google request per proxy without database rows'''
+
+    url = 'https://www.google.com/search?'
+
+    def __init__(self, concurrency=None, timeout=None):
+        self.concurrency = concurrency or settings.BAN_CHECK_CONCURRENCY
+        self.timeout = timeout or settings.BAN_CHECK_TIMEOUT
+
+    def get_url(self):
+        '''return google search url for random query'''
+        q = ''.join(random.choice(string.ascii_lowercase) for _ in range(10))
+        return self.url + urlencode({'q': q, 'hl': 'en'})
+
+    def probe(self, proxy, user_agent=None):
+        '''return True if banned, False if not or None if unreachable'''
+        headers = {}
+        if user_agent:
+            headers['User-Agent'] = user_agent
+        try:
+            response = requests.get(
+                self.get_url(), headers=headers, timeout=self.timeout,
+                proxies=proxy.get_request_proxies(), allow_redirects=False
+            )
+        except (requests.ConnectionError, requests.Timeout):
+            return
+        return is_banned(response)
+
+    def probe_all(self, proxies):
+        '''return ban results for list of proxies'''
+        from .models import UserAgent
+        user_agent = UserAgent.get_user_agent_string()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            return list(
+                executor.map(
+                    lambda proxy: self.probe(proxy, user_agent), proxies
+                )
+            )
+
+    def save(self, results):
+        '''write ban status with one update per status and chunk'''
+        from .models import Proxy
+        now = timezone.now()
+        for chunk in chunks(list(results.items()), settings.CHECK_CHUNK_SIZE):
+            banned = [pk for pk, result in chunk if result]
+            unbanned = [pk for pk, result in chunk if result is False]
+            offline = [pk for pk, result in chunk if result is None]
+            Proxy.objects.filter(pk__in=banned).update(
+                online=True, google_ban=True, date_online=now,
+                date_google_ban=now, date_updated=now
+            )
+            Proxy.objects.filter(pk__in=unbanned).update(
+                online=True, google_ban=False, date_online=now,
+                date_updated=now
+            )
+            Proxy.objects.filter(pk__in=offline).update(
+                online=False, date_updated=now
+            )
+
+    def check(self, proxies):
+        '''probe proxies, store results and return banned count'''
+        proxies = list(proxies)
+        start = time.monotonic()
+        bans = self.probe_all(proxies)
+        elapsed = time.monotonic() - start
+        self.save(dict(zip([proxy.pk for proxy in proxies], bans)))
+        proxy_pool.publish_reload()
+        banned = len([ban for ban in bans if ban])
+        logger.info(
+            'ban checked {} proxies in {:.1f} seconds, {:.1f} probes/second, '
+            '{} banned'.format(
+                len(proxies), elapsed, len(proxies) / max(elapsed, 1e-6),
+                banned
+            )
+        )
+        return banned
@@ -1,3 +1,11 @@
+PROXY_PROTOCOL = (
+    ('http', 'HTTP'),
+    ('https', 'HTTPS'),
+    ('socks5', 'SOCKS5'),
+)
+
+PAGE_SIZES = [10, 20, 30, 50, 100]
+
 SEARCH_CR = (
     ('countryAF', 'Afghanistan'),
     ('countryAL', 'Albania'),
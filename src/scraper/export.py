@@ -0,0 +1,218 @@
+import csv
+import io
+import json
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    ('id', 'id'),
+    ('search_id', 'search_id'),
+    ('q', 'search__q'),
+    ('page_id', 'page_id'),
+    ('page_url', 'page__url'),
+    ('rank', 'rank'),
+    ('title', 'title'),
+    ('url', 'url'),
+    ('snippet', 'snippet'),
+    ('date_added', 'date_added'),
+]
+
+NAMES = [name for name, _ in COLUMNS]
+
+
+def get_queryset(search_ids=None):
+    '''return google link rows joined with page and search metadata'''
+    from .models import GoogleLink
+    queryset = GoogleLink.objects.order_by('pk')
+    if search_ids:
+        queryset = queryset.filter(search_id__in=search_ids)
+    return queryset.values_list(*[field for _, field in COLUMNS])
+
+
+def iter_server_cursor(queryset, chunk_size):
+    '''yield rows from postgres named cursor fetching chunk size at once'''
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    with transaction.atomic(using=queryset.db):
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(
+            name='export_{}'.format(uuid.uuid4().hex)
+        )
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(sql, params)
+            yield from cursor
+        finally:
+            cursor.close()
+
+
+def iter_keyset(queryset, chunk_size):
+    '''yield rows in primary key ordered chunks'''
+    last = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last)[:chunk_size])
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1][0]
+
+
+def iter_rows(queryset, chunk_size=None):
+    '''yield rows of values queryset with constant memory'''
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    if connections[queryset.db].vendor == 'postgresql':
+        return iter_server_cursor(queryset, chunk_size)
+    return iter_keyset(queryset, chunk_size)
+
+
+def drain(buffer):
+    '''return encoded buffer contents and empty buffer'''
+    value = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return value.encode('utf-8')
+
+
+def write_csv(rows, chunk_size):
+    '''yield csv encoded chunks of rows'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(NAMES)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % chunk_size == 0:
+            yield drain(buffer)
+    yield drain(buffer)
+
+
+def write_jsonl(rows, chunk_size):
+    '''yield json lines encoded chunks of rows'''
+    buffer = io.StringIO()
+    for i, row in enumerate(rows, 1):
+        buffer.write(
+            json.dumps(dict(zip(NAMES, row)), cls=DjangoJSONEncoder) + '\n'
+        )
+        if i % chunk_size == 0:
+            yield drain(buffer)
+    yield drain(buffer)
+
+
+class ParquetSink(object):
+
+    '''write only file object handing written bytes back to caller'''
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        '''return bytes written since last drain'''
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def get_parquet_schema():
+    '''return parquet schema of export columns'''
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('search_id', pyarrow.int64()),
+        ('q', pyarrow.string()),
+        ('page_id', pyarrow.int64()),
+        ('page_url', pyarrow.string()),
+        ('rank', pyarrow.int64()),
+        ('title', pyarrow.string()),
+        ('url', pyarrow.string()),
+        ('snippet', pyarrow.string()),
+        ('date_added', pyarrow.timestamp('us', tz='UTC')),
+    ])
+
+
+def get_parquet_table(batch, schema):
+    '''return arrow table of row batch'''
+    return pyarrow.Table.from_arrays(
+        [list(column) for column in zip(*batch)], schema=schema
+    )
+
+
+def write_parquet(rows, chunk_size):
+    '''yield parquet encoded chunks of rows, one row group per chunk'''
+    schema = get_parquet_schema()
+    sink = ParquetSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == chunk_size:
+            writer.write_table(get_parquet_table(batch, schema))
+            batch = []
+            yield sink.drain()
+    if batch:
+        writer.write_table(get_parquet_table(batch, schema))
+    writer.close()
+    yield sink.drain()
+
+
+EXPORTERS = {
+    'csv': (write_csv, 'text/csv'),
+    'jsonl': (write_jsonl, 'application/x-ndjson'),
+    'parquet': (write_parquet, 'application/octet-stream'),
+}
+
+
+def get_content_type(export_format):
+    '''return content type of export format'''
+    return EXPORTERS[export_format][1]
+
+
+def export_links(export_format, search_ids=None, chunk_size=None):
+    '''return generator of encoded google link export chunks'''
+    if export_format not in EXPORTERS:
+        raise ValueError('unknown export format {}'.format(export_format))
+    if export_format == 'parquet' and not pyarrow:
+        raise ValueError('parquet export requires pyarrow')
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    rows = iter_rows(get_queryset(search_ids), chunk_size)
+    writer = EXPORTERS[export_format][0]
+    return log_export(writer(rows, chunk_size), export_format)
+
+
+def log_export(chunks, export_format):
+    '''pass chunks through and log exported size and rate'''
+    start = time.monotonic()
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    logger.info(
+        'exported {:.1f} MB of google links as {} in {:.1f} seconds'.format(
+            size / 1024 / 1024, export_format, time.monotonic() - start
+        )
+    )
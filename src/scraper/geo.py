@@ -0,0 +1,69 @@
+import logging
+import threading
+import time
+
+from collections import defaultdict
+
+import GeoIP
+
+from django.conf import settings
+from django.db.models import Q
+
+from .checks import chunks
+
+logger = logging.getLogger(__name__)
+
+
+class GeoLocator(object):
+
+    '''geoip database opened once per process and memory mapped'''
+
+    def __init__(self, path=None):
+        self.path = path
+        self._db = None
+        self.lock = threading.Lock()
+
+    @property
+    def db(self):
+        '''lazily opened geoip database'''
+        with self.lock:
+            if not self._db:
+                self._db = GeoIP.open(
+                    self.path or settings.GEOIP_DATABASE,
+                    GeoIP.GEOIP_MMAP_CACHE
+                )
+        return self._db
+
+    def get_country(self, host):
+        '''return country name for ip address or None'''
+        record = self.db.record_by_addr(host)
+        if record:
+            return record['country_name']
+
+    def enrich(self, proxies=None):
+        '''set missing proxy countries with one update per country'''
+        from .models import Proxy
+        if proxies is None:
+            proxies = Proxy.objects.all()
+        proxies = proxies.filter(Q(country__isnull=True) | Q(country=''))
+        start = time.monotonic()
+        countries = defaultdict(list)
+        for pk, host in proxies.values_list('id', 'host').iterator():
+            country = self.get_country(host)
+            if country:
+                countries[country].append(pk)
+        count = 0
+        for country, ids in countries.items():
+            for chunk in chunks(ids, settings.CHECK_CHUNK_SIZE):
+                count += Proxy.objects.filter(pk__in=chunk).update(
+                    country=country
+                )
+        logger.info(
+            'set country for {} proxies in {:.1f} seconds'.format(
+                count, time.monotonic() - start
+            )
+        )
+        return count
+
+
+geolocator = GeoLocator()
@@ -0,0 +1,275 @@
+import json
+import logging
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+
+import redis
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# pop the next chunk of a batch and start the in flight ttl of its searches
+# in one step, so a crash in between cannot leave marks without expiry
+POP_SCRIPT = '''
+local chunk = redis.call('LPOP', KEYS[1])
+if not chunk then
+    return false
+end
+for _, pk in ipairs(cjson.decode(chunk)[1]) do
+    redis.call('EXPIRE', ARGV[1] .. pk, ARGV[2])
+end
+return chunk
+'''
+
+
+class JobQueue(object):
+
+    '''search jobs in priority lanes with in flight dedup and fair batches'''
+
+    prefix = 'google_scraper:jobs:'
+
+    def __init__(self, url=None):
+        self.url = url
+        self._client = None
+        self._script = None
+
+    @property
+    def client(self):
+        '''lazily connected redis client'''
+        if not self._client:
+            self._client = redis.StrictRedis.from_url(
+                self.url or settings.JOB_QUEUE_URL
+            )
+        return self._client
+
+    @property
+    def script(self):
+        '''registered chunk pop script'''
+        if not self._script:
+            self._script = self.client.register_script(POP_SCRIPT)
+        return self._script
+
+    def get_key(self, *parts):
+        '''return redis key for parts'''
+        return self.prefix + ':'.join(str(part) for part in parts)
+
+    def claim(self, ids):
+        '''mark searches in flight and return ids not already in flight'''
+        pipe = self.client.pipeline(transaction=False)
+        for pk in ids:
+            pipe.set(
+                self.get_key('search', pk), 1, nx=True,
+                ex=settings.JOB_INFLIGHT_TTL
+            )
+        claimed = [pk for pk, ok in zip(ids, pipe.execute()) if ok]
+        if len(claimed) < len(ids):
+            logger.info(
+                'skipped {} searches already in flight'.format(
+                    len(ids) - len(claimed)
+                )
+            )
+        return claimed
+
+    def release(self, ids):
+        '''clear in flight marks of searches'''
+        if ids:
+            self.client.delete(*[self.get_key('search', pk) for pk in ids])
+
+    def get_inflight(self, ids):
+        '''return set of search ids that are queued or in flight'''
+        ids = list(ids)
+        if not ids:
+            return set()
+        marks = self.client.mget([self.get_key('search', pk) for pk in ids])
+        return {pk for pk, mark in zip(ids, marks) if mark}
+
+    def refresh(self, ids, token=None):
+        '''extend in flight marks and bulk slot of a running task'''
+        pipe = self.client.pipeline(transaction=False)
+        for pk in ids:
+            pipe.expire(self.get_key('search', pk), settings.JOB_INFLIGHT_TTL)
+        if token:
+            pipe.zadd(
+                self.get_key('running'),
+                time.time() + settings.JOB_INFLIGHT_TTL, token
+            )
+        pipe.execute()
+
+    @contextmanager
+    def heartbeat(self, ids, token=None):
+        '''refresh in flight marks from a thread while the block runs'''
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(settings.JOB_HEARTBEAT_INTERVAL):
+                try:
+                    self.refresh(ids, token)
+                except redis.RedisError as e:
+                    logger.warning('job heartbeat failed {}'.format(e))
+
+        thread = threading.Thread(target=beat)
+        thread.daemon = True
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def get_lane(self, ids):
+        '''return interactive lane for small submissions, bulk otherwise'''
+        if len(ids) <= settings.JOB_INTERACTIVE_LIMIT:
+            return 'interactive'
+        return 'bulk'
+
+    def send(self, ids, lane, enqueued, token=None):
+        '''send scrape task for search ids to lane queue'''
+        from .tasks import _search_task
+        from .utils import compress_ids
+        _search_task.apply_async(
+            args=[compress_ids(ids), lane, enqueued, token],
+            queue=settings.JOB_QUEUES[lane]
+        )
+
+    def submit(self, ids, lane=None, batch=None):
+        '''queue searches not in flight, bulk ones in a round robin batch'''
+        ids = self.claim(list(ids))
+        if not ids:
+            return
+        lane = lane or self.get_lane(ids)
+        size = settings.TASK_CHUNK_SIZE if settings.USE_ASYNC_SCRAPER else 1
+        chunks = [ids[i:i + size] for i in range(0, len(ids), size)]
+        enqueued = time.time()
+        if lane == 'interactive':
+            for i, chunk in enumerate(chunks):
+                try:
+                    self.send(chunk, lane, enqueued)
+                except Exception:
+                    self.release(ids[i * size:])
+                    raise
+            return
+        batch = batch or uuid.uuid4().hex
+        pipe = self.client.pipeline()
+        pipe.rpush(
+            self.get_key('batch', batch),
+            *[json.dumps([chunk, enqueued]) for chunk in chunks]
+        )
+        pipe.lrem(self.get_key('batches'), 0, batch)
+        pipe.rpush(self.get_key('batches'), batch)
+        # marks of waiting chunks live as long as the batch list holds them,
+        # their ttl starts again when the chunk is popped for dispatch
+        for pk in ids:
+            pipe.persist(self.get_key('search', pk))
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            self.release(ids)
+            raise
+        logger.info(
+            'queued {} searches in {} chunks for batch {}'.format(
+                len(ids), len(chunks), batch
+            )
+        )
+        self.dispatch()
+
+    def get_running(self):
+        '''return count of unexpired bulk chunks being scraped'''
+        key = self.get_key('running')
+        self.client.zremrangebyscore(key, '-inf', time.time())
+        return self.client.zcard(key)
+
+    def acquire(self):
+        '''reserve bulk slot and return token or None when lane is full'''
+        key = self.get_key('running')
+        token = uuid.uuid4().hex
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zadd(key, now + settings.JOB_INFLIGHT_TTL, token)
+        pipe.zcard(key)
+        if pipe.execute()[2] <= settings.JOB_BULK_CONCURRENCY:
+            return token
+        self.client.zrem(key, token)
+
+    def pop(self, batch):
+        '''return next chunk of batch, starting in flight ttl, or None'''
+        return self.script(
+            keys=[self.get_key('batch', batch)],
+            args=[self.get_key('search', ''), settings.JOB_INFLIGHT_TTL]
+        )
+
+    def dispatch(self):
+        '''send pending bulk chunks taking one per batch in turn'''
+        batches = self.get_key('batches')
+        sent = 0
+        while True:
+            token = self.acquire()
+            if not token:
+                break
+            batch = self.client.rpoplpush(batches, batches)
+            chunk = None
+            while batch:
+                chunk = self.pop(batch.decode())
+                if chunk:
+                    break
+                self.client.lrem(batches, 0, batch)
+                batch = self.client.rpoplpush(batches, batches)
+            if not chunk:
+                self.client.zrem(self.get_key('running'), token)
+                break
+            ids, enqueued = json.loads(chunk.decode())
+            try:
+                self.send(ids, 'bulk', enqueued, token)
+            except Exception:
+                self.release(ids)
+                self.client.zrem(self.get_key('running'), token)
+                raise
+            sent += 1
+        if sent:
+            logger.info('dispatched {} bulk chunks'.format(sent))
+        return sent
+
+    def done(self, ids, lane, enqueued=None, token=None):
+        '''release finished searches, record wait and refill bulk lane'''
+        self.release(ids)
+        if enqueued:
+            key = self.get_key('wait', lane)
+            pipe = self.client.pipeline()
+            pipe.lpush(key, round(time.time() - enqueued, 3))
+            pipe.ltrim(key, 0, settings.JOB_WAIT_SAMPLES - 1)
+            pipe.execute()
+        if lane != 'bulk':
+            return
+        if token:
+            self.client.zrem(self.get_key('running'), token)
+        self.dispatch()
+
+    def stats(self):
+        '''return queue depth and recent wait seconds per lane'''
+        stats = {}
+        for lane, queue in settings.JOB_QUEUES.items():
+            waits = [
+                float(wait) for wait in
+                self.client.lrange(self.get_key('wait', lane), 0, -1)
+            ]
+            stats[lane] = {
+                'queued': self.client.llen(queue),
+                'wait_avg': round(sum(waits) / len(waits), 3)
+                if waits else None,
+                'wait_max': max(waits) if waits else None,
+            }
+        batches = self.client.lrange(self.get_key('batches'), 0, -1)
+        stats['bulk']['running'] = self.get_running()
+        stats['bulk']['batches'] = len(batches)
+        pipe = self.client.pipeline(transaction=False)
+        for batch in batches:
+            pipe.llen(self.get_key('batch', batch.decode()))
+        stats['bulk']['pending'] = sum(pipe.execute())
+        return stats
+
+
+jobs = JobQueue()
@@ -0,0 +1,64 @@
+import logging
+import time
+import uuid
+
+import redis
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseManager(object):
+
+    '''proxy leases kept in redis sorted sets scored by expiry time'''
+
+    key = 'google_scraper:proxy:{}:leases'
+
+    def __init__(self, url=None, ttl=None):
+        self.url = url
+        self.ttl = ttl
+        self._client = None
+
+    @property
+    def client(self):
+        '''lazily connected redis client'''
+        if not self._client:
+            self._client = redis.StrictRedis.from_url(
+                self.url or settings.PROXY_LEASE_URL
+            )
+        return self._client
+
+    def get_ttl(self):
+        '''return lease time to live in seconds'''
+        return self.ttl or settings.PROXY_LEASE_TTL
+
+    def acquire(self, proxy):
+        '''add expiring lease for proxy and return lease id and count'''
+        lease = uuid.uuid4().hex
+        now = time.time()
+        ttl = self.get_ttl()
+        key = self.key.format(proxy.pk)
+        pipe = self.client.pipeline()
+        pipe.zadd(key, now + ttl, lease)
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zcard(key)
+        pipe.expire(key, ttl)
+        count = pipe.execute()[2]
+        return lease, count
+
+    def release(self, proxy, lease):
+        '''remove lease for proxy'''
+        self.client.zrem(self.key.format(proxy.pk), lease)
+
+    def counts(self, proxy_ids):
+        '''return dictionary of live lease counts by proxy id'''
+        proxy_ids = list(proxy_ids)
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for pk in proxy_ids:
+            pipe.zcount(self.key.format(pk), now, '+inf')
+        return dict(zip(proxy_ids, pipe.execute()))
+
+
+leases = LeaseManager()
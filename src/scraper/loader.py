@@ -0,0 +1,224 @@
+import csv
+import io
+import logging
+import time
+import uuid
+
+from datetime import date
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FIELDS = {
+    'proxy': ['host', 'port', 'protocol', 'username', 'password'],
+    'useragent': ['string', 'weight'],
+    'googlesearch': ['q', 'cr', 'cd_min', 'cd_max', 'depth'],
+}
+
+
+class BulkLoader(object):
+
+    '''streaming csv loader inserting new rows in chunks, skipping known'''
+
+    def __init__(self, model_name, chunk_size=None):
+        if model_name not in IMPORT_FIELDS:
+            raise ValueError('unknown import model {}'.format(model_name))
+        self.model = apps.get_model('scraper', model_name)
+        self.chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+        self.read = 0
+        self.inserted = 0
+        self.skipped = 0
+
+    def get_unique_fields(self):
+        '''return field names identifying existing rows or None'''
+        opts = self.model._meta
+        if opts.unique_together:
+            return list(opts.unique_together[0])
+        for field in opts.concrete_fields:
+            if field.unique and not field.primary_key:
+                return [field.name]
+
+    def clean(self, fields, values):
+        '''return row of python values or None for invalid row'''
+        row = []
+        for field, value in zip(fields, values):
+            if value == '':
+                value = field.get_default()
+            try:
+                row.append(field.clean(value, None))
+            except ValidationError:
+                return
+        return self.set_defaults(fields, row)
+
+    def set_defaults(self, fields, row):
+        '''return row with defaults applied by model save, skipped in bulk'''
+        names = [field.name for field in fields]
+        if 'cd_min' in names and 'cd_max' in names:
+            cd_max = names.index('cd_max')
+            if row[names.index('cd_min')] and not row[cd_max]:
+                row[cd_max] = date.today()
+        return row
+
+    def iter_chunks(self, f):
+        '''yield fields and chunks of cleaned rows from csv file'''
+        reader = csv.reader(f)
+        header = next(reader)
+        names = IMPORT_FIELDS[self.model._meta.model_name]
+        missing = [
+            name for name in names if name not in header and
+            not self.model._meta.get_field(name).has_default() and
+            not self.model._meta.get_field(name).null
+        ]
+        if missing:
+            raise ValueError(
+                'missing import columns {}'.format(', '.join(missing))
+            )
+        if 'cd_min' in header and 'cd_max' not in header:
+            header.append('cd_max')
+        columns = [i for i, name in enumerate(header) if name in names]
+        fields = [self.model._meta.get_field(header[i]) for i in columns]
+        chunk = []
+        for values in reader:
+            self.read += 1
+            row = self.clean(fields, [
+                values[i].strip() if i < len(values) else '' for i in columns
+            ])
+            if row is None:
+                self.skipped += 1
+                continue
+            chunk.append(row)
+            if len(chunk) == self.chunk_size:
+                yield fields, chunk
+                chunk = []
+        if chunk:
+            yield fields, chunk
+
+    def get_missing_values(self, fields):
+        '''return columns and values for fields not in file'''
+        now = timezone.now()
+        columns, values = [], []
+        for field in self.model._meta.concrete_fields:
+            if field.primary_key or field in fields:
+                continue
+            columns.append(field.column)
+            if getattr(field, 'auto_now', False) or \
+                    getattr(field, 'auto_now_add', False):
+                values.append(now)
+            else:
+                values.append(
+                    field.get_db_prep_save(field.get_default(), connection)
+                )
+        return columns, values
+
+    def copy(self, fields, chunk):
+        '''copy chunk into temp table and insert rows not conflicting'''
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        temp = quote('import_{}'.format(uuid.uuid4().hex))
+        columns = ', '.join(quote(field.column) for field in fields)
+        missing, values = self.get_missing_values(fields)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in chunk:
+            writer.writerow([
+                '\\N' if value is None else value for value in row
+            ])
+        buffer.seek(0)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} '
+                'WITH NO DATA'.format(temp, columns, table)
+            )
+            cursor.copy_expert(
+                "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+                .format(temp, columns), buffer
+            )
+            cursor.execute(
+                'INSERT INTO {} ({}) SELECT {} FROM {} '
+                'ON CONFLICT DO NOTHING'.format(
+                    table,
+                    ', '.join([columns] + [quote(name) for name in missing]),
+                    ', '.join([columns] + ['%s'] * len(values)),
+                    temp
+                ), values
+            )
+            return cursor.rowcount
+
+    def create(self, fields, chunk):
+        '''bulk create rows of chunk whose unique fields are not stored'''
+        objects = {}
+        unique = self.get_unique_fields()
+        for row in chunk:
+            obj = self.model(**{
+                field.name: value for field, value in zip(fields, row)
+            })
+            key = tuple(getattr(obj, name) for name in unique or [])
+            objects[key if unique else len(objects)] = obj
+        if unique:
+            keys = list(objects)
+            # sqlite limits query parameters, look up keys in batches
+            size = connection.ops.bulk_batch_size(unique, keys)
+            for i in range(0, len(keys), size):
+                batch = keys[i:i + size]
+                existing = self.model.objects.filter(**{
+                    '{}__in'.format(name): {key[j] for key in batch}
+                    for j, name in enumerate(unique)
+                })
+                for key in existing.values_list(*unique):
+                    objects.pop(tuple(key), None)
+        self.model.objects.bulk_create(objects.values())
+        return len(objects)
+
+    def load(self, f):
+        '''load csv file object and return import statistics'''
+        start = time.monotonic()
+        for fields, chunk in self.iter_chunks(f):
+            if connection.vendor == 'postgresql':
+                self.inserted += self.copy(fields, chunk)
+            else:
+                self.inserted += self.create(fields, chunk)
+            logger.info(
+                'imported {} of {} {} rows'.format(
+                    self.inserted, self.read, self.model._meta.model_name
+                )
+            )
+        seconds = time.monotonic() - start
+        stats = {
+            'read': self.read,
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(self.read / seconds if seconds else 0),
+        }
+        logger.info(
+            'bulk import of {} finished {}'.format(
+                self.model._meta.model_name, stats
+            )
+        )
+        self.finish()
+        return stats
+
+    def finish(self):
+        '''refresh caches and queue enrichment of inserted rows'''
+        from .agents import user_agents
+        from .pool import proxy_pool
+        from .tasks import country_check_task
+        model_name = self.model._meta.model_name
+        if not self.inserted:
+            return
+        if model_name == 'proxy':
+            proxy_pool.publish_reload()
+            country_check_task.delay()
+        elif model_name == 'useragent':
+            user_agents.changed()
+
+
+def load_file(model_name, path, chunk_size=None):
+    '''load csv file at path and return import statistics'''
+    with open(path, encoding='utf-8', newline='') as f:
+        return BulkLoader(model_name, chunk_size).load(f)
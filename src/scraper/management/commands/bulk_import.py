@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from scraper.loader import IMPORT_FIELDS, load_file
+from scraper.tasks import bulk_import_task
+
+
+class Command(BaseCommand):
+
+    help = 'Stream proxies, user agents or searches from a csv file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(IMPORT_FIELDS))
+        parser.add_argument('path', help='csv file with header row')
+        parser.add_argument(
+            '--async', action='store_true', dest='use_async',
+            help='queue import on celery worker reading the same path'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=None,
+            help='rows inserted per statement'
+        )
+
+    def handle(self, *args, **options):
+        if options['use_async']:
+            bulk_import_task.delay(options['model'], options['path'])
+            self.stdout.write('queued bulk_import_task')
+            return
+        try:
+            stats = load_file(
+                options['model'], options['path'], options['chunk_size']
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            'read {read}, inserted {inserted}, skipped {skipped} rows in '
+            '{seconds} seconds ({rows_per_second} rows/second)'.format(**stats)
+        )
@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scraper.export import EXPORTERS, export_links
+
+
+class Command(BaseCommand):
+
+    help = 'Stream google links with page and search metadata to a file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=sorted(EXPORTERS), default='csv',
+            help='export format'
+        )
+        parser.add_argument(
+            '--search', type=int, nargs='*', default=[],
+            help='only export links of these search ids'
+        )
+        parser.add_argument(
+            '--output', default='-', help='output path, - for stdout'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            chunks = export_links(options['format'], options['search'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['output'] == '-':
+            output = sys.stdout.buffer
+        else:
+            output = open(options['output'], 'wb')
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
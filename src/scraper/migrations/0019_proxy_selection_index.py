@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0018_remove_googlepage_total_result_count'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='proxy',
+            index_together=set([
+                ('online', 'google_ban', 'scraper_count', 'speed')
+            ]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0020_page_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proxy',
+            name='protocol',
+            field=models.CharField(choices=[('http', 'HTTP'), ('https', 'HTTPS'), ('socks5', 'SOCKS5')], default='http', max_length=6),
+        ),
+        migrations.AddField(
+            model_name='proxy',
+            name='username',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='proxy',
+            name='password',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
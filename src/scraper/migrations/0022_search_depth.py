@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0021_proxy_transport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='googlesearch',
+            name='depth',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='results wanted'),
+        ),
+        migrations.AddField(
+            model_name='googlesearch',
+            name='request_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
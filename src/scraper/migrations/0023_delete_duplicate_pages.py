@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def delete_duplicate_pages(apps, schema_editor):
+    '''keep first stored page per search and start'''
+    GooglePage = apps.get_model('scraper', 'GooglePage')
+    duplicates = GooglePage.objects.values('search', 'start').annotate(
+        count=Count('id'), first=Min('id')
+    ).filter(count__gt=1)
+    for duplicate in duplicates:
+        GooglePage.objects.filter(
+            search=duplicate['search'], start=duplicate['start']
+        ).exclude(pk=duplicate['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0022_search_depth'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            delete_duplicate_pages, migrations.RunPython.noop
+        ),
+    ]
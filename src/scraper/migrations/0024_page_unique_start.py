@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0023_delete_duplicate_pages'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='googlepage',
+            unique_together=set([('search', 'start')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0024_page_unique_start'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useragent',
+            name='weight',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
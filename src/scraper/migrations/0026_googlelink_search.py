@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0025_useragent_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='googlelink',
+            name='search',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='scraper.GoogleSearch'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0026_googlelink_search'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'UPDATE scraper_googlelink SET search_id = ('
+            'SELECT search_id FROM scraper_googlepage '
+            'WHERE scraper_googlepage.id = scraper_googlelink.page_id)',
+            migrations.RunSQL.noop
+        ),
+    ]
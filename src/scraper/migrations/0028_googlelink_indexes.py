@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+TRIGRAM_INDEXES = [
+    ('scraper_googlelink', 'title'),
+    ('scraper_googlelink', 'url'),
+    ('scraper_googlelink', 'snippet'),
+    ('scraper_googlepage', 'url'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    '''gin trigram indexes matching admin icontains search on postgres'''
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX {0}_{1}_trgm ON {0} '
+            'USING gin (UPPER({1}::text) gin_trgm_ops)'.format(table, column)
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    '''drop gin trigram indexes on postgres'''
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS {}_{}_trgm'.format(table, column)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0027_backfill_googlelink_search'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='googlelink',
+            index_together=set([('search', 'rank')]),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
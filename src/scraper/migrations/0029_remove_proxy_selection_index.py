@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0028_googlelink_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='proxy',
+            index_together=set([]),
+        ),
+    ]
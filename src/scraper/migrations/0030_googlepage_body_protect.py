@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0029_remove_proxy_selection_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='googlepage',
+            name='body',
+            field=models.ForeignKey(
+                blank=True, null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to='scraper.PageBody'
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scraper', '0030_googlepage_body_protect'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proxy',
+            name='latency',
+            field=models.FloatField(null=True, blank=True),
+        ),
+    ]
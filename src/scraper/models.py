@@ -1,41 +1,55 @@
 import logging
-import random
-import socket
-import string
-import time
 
 from datetime import date
-from urllib.parse import urlencode
-
-import GeoIP
+from urllib.parse import quote, urlencode
 
 from django.conf import settings
 from django.db import models
-from django.utils import timezone
-
-from .utils import GoogleScraper
+from django.db.models.signals import post_delete, post_save
+
+from .agents import user_agents, user_agents_changed
+from .cache import search_cache
+from .geo import geolocator
+from .leases import leases
+from .pool import proxy_pool
+from .utils import GoogleScraper, weighted_choice
 from .choices import *
 
 logger = logging.getLogger(__name__)
 
 
+class UpdateFieldsMixin(object):
+
+    '''write only changed columns of model instance'''
+
+    def set_fields(self, **fields):
+        '''set field values and save changed ones with single update'''
+        changed = [
+            name for name, value in fields.items()
+            if getattr(self, name) != value
+        ]
+        for name in changed:
+            setattr(self, name, fields[name])
+        if changed:
+            self.save(update_fields=changed + ['date_updated'])
+        return changed
+
+
 class UserAgent(models.Model):
 
     '''database record for user agent'''
 
     string = models.TextField(unique=True)
+    weight = models.PositiveIntegerField(default=1)
     date_added = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.string
 
     @staticmethod
-    def get_user_agent_string():
-        '''return user agent or None'''
-        try:
-            return UserAgent.objects.order_by('?').first().string
-        except AttributeError:
-            logger.info('no user agents in database')
+    def get_user_agent_string(proxy=None):
+        '''return cached weighted user agent, sticky per proxy, or None'''
+        return user_agents.get(proxy)
 
 
 class Proxy(models.Model):
@@ -44,9 +58,15 @@ class Proxy(models.Model):
 
     host = models.GenericIPAddressField(protocol='IPv4')
     port = models.PositiveIntegerField()
+    protocol = models.CharField(
+        max_length=6, choices=PROXY_PROTOCOL, default='http'
+    )
+    username = models.CharField(max_length=100, null=True, blank=True)
+    password = models.CharField(max_length=100, null=True, blank=True)
     online = models.NullBooleanField()
     google_ban = models.NullBooleanField()
     speed = models.FloatField(null=True, blank=True)
+    latency = models.FloatField(null=True, blank=True)
     country = models.TextField(null=True, blank=True)
     scraper_count = models.PositiveIntegerField(default=0)
     date_added = models.DateTimeField(auto_now_add=True)
@@ -61,121 +81,63 @@ class Proxy(models.Model):
     def __str__(self):
         return '{}:{}'.format(self.host, self.port)
 
-    def save(self, *args, **kwargs):
-        self.country_check()
-        super().save(*args, **kwargs)
-
     @staticmethod
-    def get_proxy():
-        '''return working proxy with lowest connection count or None'''
-        proxies = Proxy.objects.exclude(online=False, google_ban=True)
-        return proxies.order_by('-scraper_count').first()
+    def pick_proxy(proxies):
+        '''return random proxy weighted by live lease count and latency'''
+        counts = leases.counts(proxy.pk for proxy in proxies)
+        weights = [proxy.get_weight(counts[proxy.pk]) for proxy in proxies]
+        return weighted_choice(proxies, weights)
 
-    def register(self):
-        '''increment scraper count before http request'''
-        self.scraper_count += 1
-        self.save()
-        logger.debug(
-            'proxy {} is connected to {} scrapers'.format(
-                self, self.scraper_count
-            )
-        )
+    def get_weight(self, lease_count):
+        '''return selection weight from lease count and latency'''
+        return 1 / ((1 + lease_count) * self.get_latency())
+
+    def get_latency(self):
+        '''return request latency, else connect time, else timeout'''
+        return self.latency or self.speed or settings.PROXY_TIMEOUT
+
+    @property
+    def url(self):
+        '''proxy url with scheme and credentials'''
+        scheme = self.protocol
+        if scheme == 'socks5':
+            scheme = 'socks5h'
+        auth = ''
+        if self.username:
+            password = quote(self.password or '', safe='')
+            auth = '{}:{}@'.format(quote(self.username, safe=''), password)
+        return '{}://{}{}:{}'.format(scheme, auth, self.host, self.port)
+
+    def get_request_proxies(self):
+        '''return proxies dictionary routing both schemes for requests'''
+        return {'http': self.url, 'https': self.url}
 
-    def unregister(self):
-        '''decrement scraper count after http request'''
-        self.scraper_count -= 1
-        self.save()
+    def register(self):
+        '''acquire expiring lease before http request and return lease id'''
+        lease, self.scraper_count = leases.acquire(self)
         logger.debug(
             'proxy {} is connected to {} scrapers'.format(
                 self, self.scraper_count
             )
         )
+        return lease
 
-    def set_online(self):
-        '''set status to online'''
-        if not self.online:
-            self.online = True
-        self.date_online = timezone.now()
-        self.save()
-        logger.info('proxy {} is online'.format(self))
-
-    def unset_online(self):
-        '''set status to offline'''
-        if self.online is not False:
-            self.online = False
-            self.save()
-        logger.debug('proxy {} is not online'.format(self))
-
-    def set_google_ban(self):
-        '''set status to banned'''
-        if not self.google_ban:
-            self.google_ban = True
-        self.date_google_ban = timezone.now()
-        self.save()
-        logger.info('proxy {} is banned by google'.format(self))
-
-    def unset_google_ban(self):
-        '''set status to unbanned'''
-        if self.google_ban is not False:
-            self.google_ban = False
-            self.save()
-        logger.debug('proxy {} is not banned by google'.format(self))
-
-    def set_speed(self, time):
-        '''set speed to value'''
-        self.speed = time
-        self.save()
-        logger.debug('proxy {} speed is {}'.format(self, self.speed))
-
-    def unset_speed(self):
-        '''set speed to None'''
-        self.speed = None
-        self.save()
-
-    def online_check(self):
-        '''create connection to the proxy server and record status'''
-        logger.debug('starting online check for {}'.format(self))
-        start = time.time()
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(settings.PROXY_TIMEOUT)
-        try:
-            sock.connect((self.host, self.port))
-            self.set_online()
-            self.set_speed(time.time() - start)
-        except (socket.error, socket.timeout):
-            self.unset_online()
-            self.unset_speed()
-
-    def google_ban_check(self):
-        '''send random query to google and record status'''
-        self.online_check()
-        if not self.online:
-            return
-        logger.debug('starting google ban check for {}'.format(self))
-        q = ''.join(random.choice(string.ascii_lowercase) for _ in range(10))
-        search = GoogleSearch.objects.create(q=q)
-        scraper = GoogleScraper(
-            search, UserAgent.get_user_agent_string(), self
-        )
-        scraper.do_request()
-        search.delete()
+    def unregister(self, lease):
+        '''release lease after http request'''
+        leases.release(self, lease)
+        logger.debug('proxy {} released lease {}'.format(self, lease))
 
     def country_check(self):
         '''query geoip database for proxy country'''
         if self.country:
             return
         logger.debug('starting geoip check for {}'.format(self))
-        geoip = GeoIP.open(
-            '/usr/local/share/GeoIP/GeoLiteCity.dat', GeoIP.GEOIP_STANDARD
-        )
-        record = geoip.record_by_addr(self.host)
-        if not record:
-            return
-        self.country = record['country_name']
-        self.save()
+        self.country = geolocator.get_country(self.host)
+        if self.country:
+            self.save(update_fields=['country'])
 
 
-class GoogleSearch(models.Model):
+class GoogleSearch(UpdateFieldsMixin, models.Model):
 
     '''database record for google search'''
 
@@ -186,7 +148,11 @@ class GoogleSearch(models.Model):
     )
     cd_min = models.DateField(verbose_name='date start', null=True, blank=True)
     cd_max = models.DateField(verbose_name='date end', null=True, blank=True)
+    depth = models.PositiveIntegerField(
+        verbose_name='results wanted', null=True, blank=True
+    )
     result_count = models.PositiveIntegerField(default=0)
+    request_count = models.PositiveIntegerField(default=0)
     success = models.NullBooleanField()
     date_added = models.DateTimeField(auto_now_add=True)
     date_updated = models.DateTimeField(auto_now=True)
@@ -202,22 +168,33 @@ class GoogleSearch(models.Model):
             self.cd_max = date.today()
         super().save(*args, **kwargs)
 
-    def set_success(self, value):
-        '''set success to value'''
-        self.success = value
-        self.save()
+    def set_results(self, count, success, request_count=0):
+        '''set result count, request count and success with single update'''
+        self.set_fields(
+            result_count=count, success=success, request_count=request_count
+        )
+        logger.info(
+            'result count for google search {} is {} with {} requests per '
+            'result'.format(self.q, count, self.get_requests_per_result())
+        )
         if self.success:
             logger.info('google search for query {} succeded'.format(self.q))
         else:
             logger.info('google search for query {} failed'.format(self.q))
 
-    def set_result_count(self, count):
-        '''set result count to value'''
-        self.result_count = count
-        self.save()
-        logger.info(
-            'result count for google search {} is {}'.format(self.q, count)
-        )
+    def get_requests_per_result(self):
+        '''return http requests spent per scraped result or None'''
+        if self.result_count:
+            return round(self.request_count / self.result_count, 3)
+
+    def get_page_size(self):
+        '''return smallest page size covering depth in a single request'''
+        if not self.depth:
+            return settings.RESULT_PER_PAGE
+        for size in PAGE_SIZES:
+            if size >= self.depth:
+                return size
+        return PAGE_SIZES[-1]
 
     def get_query_params(self):
         '''return query params to be added to google search url'''
@@ -227,8 +204,9 @@ class GoogleSearch(models.Model):
             'hl': 'en',
             'nfpr': '1'
         }
-        if settings.RESULT_PER_PAGE != 10:
-            params['num'] = str(settings.RESULT_PER_PAGE)
+        page_size = self.get_page_size()
+        if page_size != 10:
+            params['num'] = str(page_size)
         if self.cd_min and self.cd_max:
             cd_min = self.cd_min.strftime('%m/%d/%Y')
             cd_max = self.cd_max.strftime('%m/%d/%Y')
@@ -243,28 +221,53 @@ class GoogleSearch(models.Model):
         base = 'https://www.google.com/search?'
         return base + urlencode(self.get_query_params())
 
+    def get_scraper_params(self):
+        '''return GoogleScraper init parameters to be unpacked'''
+        proxy = proxy_pool.get_proxy() if settings.USE_PROXY else None
+        return [self, UserAgent.get_user_agent_string(proxy), proxy]
+
     def search(self):
         '''search call on GoogleScraper object'''
-        params = [self, UserAgent.get_user_agent_string()]
-        if settings.USE_PROXY:
-            params.append(Proxy.get_proxy())
-        scraper = GoogleScraper(*params)
+        if search_cache.restore(self):
+            return
+        scraper = GoogleScraper(*self.get_scraper_params())
         scraper.scrape()
 
 
+class PageBody(models.Model):
+
+    '''database record for compressed page html'''
+
+    digest = models.CharField(max_length=64, unique=True)
+    codec = models.CharField(max_length=10)
+    size = models.PositiveIntegerField()
+    data = models.BinaryField(null=True, blank=True)
+    path = models.TextField(null=True, blank=True)
+    date_added = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.digest
+
+
 class GooglePage(models.Model):
 
     '''database record for google page'''
 
     search = models.ForeignKey('GoogleSearch')
     url = models.URLField()
-    html = models.TextField()
+    html = models.TextField(blank=True)
+    body = models.ForeignKey(
+        'PageBody', null=True, blank=True, on_delete=models.PROTECT
+    )
     result_count = models.PositiveIntegerField()
     start = models.PositiveIntegerField()
     end = models.PositiveIntegerField()
     next_page = models.URLField(null=True, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        unique_together = ['search', 'start']
+
     def __str__(self):
         return self.url
 
@@ -274,11 +277,19 @@ class GoogleLink(models.Model):
     '''database record for google link'''
 
     page = models.ForeignKey('GooglePage')
+    search = models.ForeignKey('GoogleSearch', null=True, blank=True)
     title = models.CharField(max_length=100)
     url = models.URLField()
     snippet = models.TextField()
     rank = models.IntegerField()
     date_added = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        index_together = ['search', 'rank']
+
     def __str__(self):
         return self.title
+
+
+post_save.connect(user_agents_changed, sender=UserAgent)
+post_delete.connect(user_agents_changed, sender=UserAgent)
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+
+    '''paginator using planner row estimate and primary key seek pages'''
+
+    @cached_property
+    def count(self):
+        '''return table row estimate for large unfiltered lists'''
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] > settings.ADMIN_ESTIMATE_THRESHOLD:
+                return int(row[0])
+        return super().count
+
+    def page(self, number):
+        '''return page fetching primary keys first, then only their rows'''
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        pks = list(
+            self.object_list.values_list('pk', flat=True)[
+                bottom:bottom + self.per_page
+            ]
+        )
+        object_list = self.object_list.filter(pk__in=pks)
+        return self._get_page(object_list, number, self)
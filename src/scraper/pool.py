@@ -0,0 +1,246 @@
+import atexit
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import redis
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyPool(object):
+
+    '''per worker proxy cache kept in sync over redis pub/sub'''
+
+    channel = 'google_scraper:proxy'
+
+    def __init__(self, url=None):
+        self.url = url
+        self.reset()
+        atexit.register(self.flush)
+
+    def reset(self):
+        '''drop cached state, used on first use and after fork'''
+        self.pid = os.getpid()
+        self.origin = uuid.uuid4().hex
+        self.lock = threading.RLock()
+        self.proxies = {}
+        self.dirty = {}
+        self.date_loaded = None
+        self.date_reload = 0
+        self.date_flushed = time.monotonic()
+        self.listener = None
+        self._client = None
+
+    @property
+    def client(self):
+        '''lazily connected redis client'''
+        if not self._client:
+            self._client = redis.StrictRedis.from_url(
+                self.url or settings.PROXY_POOL_URL
+            )
+        return self._client
+
+    def check(self):
+        '''load, subscribe and flush as needed before using the pool'''
+        if self.pid != os.getpid():
+            self.reset()
+        now = time.monotonic()
+        with self.lock:
+            if not self.listener or not self.listener.is_alive():
+                self.subscribe()
+            if not self.date_loaded or \
+                    now - self.date_loaded > settings.PROXY_POOL_REFRESH:
+                self.load()
+        if now - self.date_flushed > settings.PROXY_POOL_FLUSH:
+            self.flush()
+
+    def load(self):
+        '''load all proxies and reapply changes newer than last reload'''
+        from .models import Proxy
+        with self.lock:
+            for pk in list(self.dirty):
+                self.dirty[pk] = {
+                    key: (value, date) for key, (value, date)
+                    in self.dirty[pk].items() if date > self.date_reload
+                }
+                if not self.dirty[pk]:
+                    del self.dirty[pk]
+            date_loaded = time.monotonic()
+            proxies = {proxy.pk: proxy for proxy in Proxy.objects.all()}
+            for pk, fields in self.dirty.items():
+                if pk in proxies:
+                    self.apply(proxies[pk], {
+                        key: value for key, (value, _) in fields.items()
+                    })
+            self.proxies = proxies
+            self.date_loaded = date_loaded
+        logger.debug('loaded {} proxies into pool'.format(len(proxies)))
+
+    def request_reload(self):
+        '''drop pending changes and reload pool on next use'''
+        with self.lock:
+            self.date_reload = time.monotonic()
+            self.date_loaded = None
+
+    def subscribe(self):
+        '''start thread applying proxy changes from other workers'''
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        self.listener = threading.Thread(target=self.listen, args=[pubsub])
+        self.listener.daemon = True
+        self.listener.start()
+
+    def listen(self, pubsub):
+        '''apply published proxy changes until the connection fails'''
+        try:
+            for message in pubsub.listen():
+                try:
+                    self.receive(json.loads(message['data'].decode()))
+                except (ValueError, KeyError) as e:
+                    logger.warning('invalid proxy pool event {}'.format(e))
+        except redis.RedisError as e:
+            logger.warning('proxy pool listener stopped {}'.format(e))
+            # changes published while disconnected are lost, reload on
+            # next use which also starts a new listener
+            self.date_loaded = None
+        finally:
+            pubsub.close()
+
+    def receive(self, event):
+        '''apply proxy change or reload request of another worker'''
+        if event['origin'] == self.origin:
+            return
+        if event.get('reload'):
+            self.request_reload()
+            return
+        fields = {
+            key: parse_datetime(value) if key.startswith('date_') and
+            value else value for key, value in event['fields'].items()
+        }
+        with self.lock:
+            proxy = self.proxies.get(event['id'])
+            if proxy:
+                self.apply(proxy, fields)
+
+    def apply(self, proxy, fields):
+        '''set field values on proxy instance'''
+        for key, value in fields.items():
+            setattr(proxy, key, value)
+
+    def update(self, proxy, broadcast=True, **fields):
+        '''change proxy fields in pool, publish them and queue db write'''
+        self.check()
+        self.apply(proxy, fields)
+        with self.lock:
+            cached = self.proxies.get(proxy.pk)
+            if cached and cached is not proxy:
+                self.apply(cached, fields)
+            now = time.monotonic()
+            self.dirty.setdefault(proxy.pk, {}).update({
+                key: (value, now) for key, value in fields.items()
+            })
+        if broadcast:
+            self.client.publish(
+                self.channel,
+                json.dumps(
+                    {'origin': self.origin, 'id': proxy.pk, 'fields': fields},
+                    cls=DjangoJSONEncoder
+                )
+            )
+
+    def publish_reload(self):
+        '''ask every worker to reload pool after bulk database changes'''
+        self.request_reload()
+        self.client.publish(
+            self.channel, json.dumps({'origin': self.origin, 'reload': True})
+        )
+
+    def flush(self):
+        '''write queued proxy changes to database'''
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            self.date_flushed = time.monotonic()
+        if not dirty:
+            return
+        from .checks import chunks
+        from .models import Proxy
+        now = timezone.now()
+        for chunk in chunks(list(dirty.items()), settings.CHECK_CHUNK_SIZE):
+            names = {name for _, fields in chunk for name in fields}
+            Proxy.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+                date_updated=now, **{
+                    name: Case(
+                        *[
+                            When(pk=pk, then=Value(fields[name][0]))
+                            for pk, fields in chunk if name in fields
+                        ],
+                        default=F(name),
+                        output_field=Proxy._meta.get_field(name)
+                    ) for name in names
+                }
+            )
+        logger.debug('flushed {} proxies to database'.format(len(dirty)))
+
+    def get_proxy(self):
+        '''return random working proxy from pool or None'''
+        from .models import Proxy
+        self.check()
+        with self.lock:
+            proxies = [
+                proxy for proxy in self.proxies.values()
+                if proxy.online is not False and not proxy.google_ban
+            ]
+        proxies = heapq.nsmallest(
+            settings.PROXY_CANDIDATES, proxies,
+            key=lambda proxy: (
+                proxy.scraper_count, proxy.get_latency()
+            )
+        )
+        return Proxy.pick_proxy(proxies)
+
+    def set_online(self, proxy):
+        '''set status to online'''
+        self.update(
+            proxy, broadcast=not proxy.online, online=True,
+            date_online=timezone.now()
+        )
+
+    def set_latency(self, proxy, seconds):
+        '''blend measured request latency into proxy latency'''
+        if proxy.latency:
+            seconds = proxy.latency + settings.PROXY_LATENCY_SMOOTHING * (
+                seconds - proxy.latency
+            )
+        self.update(proxy, broadcast=False, latency=seconds)
+        logger.debug('proxy {} latency is {}'.format(proxy, seconds))
+
+    def unset_online(self, proxy):
+        '''set status to offline'''
+        if proxy.online is not False:
+            self.update(proxy, online=False)
+            logger.debug('proxy {} is not online'.format(proxy))
+
+    def set_google_ban(self, proxy):
+        '''set status to banned'''
+        self.update(proxy, google_ban=True, date_google_ban=timezone.now())
+        logger.info('proxy {} is banned by google'.format(proxy))
+
+    def unset_google_ban(self, proxy):
+        '''set status to unbanned'''
+        if proxy.google_ban is not False:
+            self.update(proxy, google_ban=False)
+            logger.debug('proxy {} is not banned by google'.format(proxy))
+
+
+proxy_pool = ProxyPool()
@@ -0,0 +1,84 @@
+import logging
+import time
+
+import redis
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# generic cell rate token bucket: the key holds the theoretical arrival time
+# of the next request, each reservation moves it one interval forward and
+# waits for whatever exceeds the burst allowance
+RESERVE_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tat < now then
+    tat = now
+end
+tat = tat + interval
+redis.call('SET', KEYS[1], tostring(tat), 'EX', math.ceil(tat - now) + 1)
+return tostring(math.max(0, tat - now - capacity * interval))
+'''
+
+
+class ProxyScheduler(object):
+
+    '''per proxy token buckets in redis shared by every worker process'''
+
+    key = 'google_scraper:proxy:{}:slot'
+
+    def __init__(self, url=None):
+        self.url = url
+        self._client = None
+        self._script = None
+
+    @property
+    def client(self):
+        '''lazily connected redis client'''
+        if not self._client:
+            self._client = redis.StrictRedis.from_url(
+                self.url or settings.SCHEDULER_URL
+            )
+        return self._client
+
+    @property
+    def script(self):
+        '''registered reservation script'''
+        if not self._script:
+            self._script = self.client.register_script(RESERVE_SCRIPT)
+        return self._script
+
+    def get_interval(self, proxy):
+        '''return seconds between requests for proxy'''
+        interval = settings.MIN_REQUEST_SLEEP
+        if proxy.latency:
+            interval *= 1 + proxy.latency / settings.PROXY_TIMEOUT
+        if proxy.date_google_ban:
+            age = (timezone.now() - proxy.date_google_ban).total_seconds()
+            if age < settings.SCHEDULER_BAN_WINDOW:
+                penalty = 1 - age / settings.SCHEDULER_BAN_WINDOW
+                interval += (settings.MAX_REQUEST_SLEEP - interval) * penalty
+        return min(interval, settings.MAX_REQUEST_SLEEP)
+
+    def reserve(self, proxy):
+        '''return seconds to wait before next request through proxy'''
+        seconds = float(self.script(
+            keys=[self.key.format(proxy.pk)],
+            args=[
+                time.time(), self.get_interval(proxy),
+                settings.SCHEDULER_BURST
+            ]
+        ))
+        logger.debug(
+            'proxy {} has next request slot in {} seconds'.format(
+                proxy, seconds
+            )
+        )
+        return seconds
+
+
+scheduler = ProxyScheduler()
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PooledSession(object):
+
+    '''keep-alive requests session for one proxy and user agent'''
+
+    def __init__(self, proxy=None, user_agent=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=settings.SESSION_POOL_MAXSIZE
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if proxy:
+            self.session.proxies = proxy.get_request_proxies()
+        if user_agent:
+            self.session.headers['User-Agent'] = user_agent
+        self.date_used = time.monotonic()
+        self.request_count = 0
+
+    def get(self, **params):
+        '''return response of get request'''
+        self.date_used = time.monotonic()
+        self.request_count += 1
+        return self.session.get(**params)
+
+    def close(self):
+        '''close pooled connections'''
+        self.session.close()
+
+
+class SessionManager(object):
+
+    '''bounded pool of idle sessions lent to one thread at a time'''
+
+    def __init__(self, size=None, idle_timeout=None):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.reused = 0
+
+    def get_key(self, proxy, user_agent):
+        '''return pool key for proxy and user agent'''
+        return str(proxy) if proxy else None, user_agent
+
+    def evict(self):
+        '''remove and return sessions idle for too long or over pool size'''
+        size = self.size or settings.SESSION_POOL_SIZE
+        timeout = self.idle_timeout or settings.SESSION_IDLE_TIMEOUT
+        now = time.monotonic()
+        evicted = []
+        while self.sessions:
+            key, session = next(iter(self.sessions.items()))
+            if len(self.sessions) <= size and \
+                    now - session.date_used < timeout:
+                break
+            del self.sessions[key]
+            evicted.append(session)
+        return evicted
+
+    def acquire(self, proxy, user_agent):
+        '''take idle session for identity out of pool or create one'''
+        with self.lock:
+            session = self.sessions.pop(self.get_key(proxy, user_agent), None)
+        return session or PooledSession(proxy, user_agent)
+
+    def release(self, proxy, user_agent, session):
+        '''return session to pool as most recently used for identity'''
+        key = self.get_key(proxy, user_agent)
+        with self.lock:
+            # another thread may have returned a session for the same
+            # identity meanwhile, keep only the one used last
+            closed = [self.sessions.pop(key, None)]
+            self.sessions[key] = session
+            closed += self.evict()
+        for old in closed:
+            if old:
+                old.close()
+
+    def discard(self, proxy, user_agent):
+        '''close idle session for identity after connection failure'''
+        with self.lock:
+            session = self.sessions.pop(self.get_key(proxy, user_agent), None)
+        if session:
+            session.close()
+
+    def request(self, proxy, user_agent, **params):
+        '''send get request through pooled session for identity'''
+        session = self.acquire(proxy, user_agent)
+        try:
+            response = session.get(**params)
+        except requests.RequestException:
+            session.close()
+            raise
+        self.release(proxy, user_agent, session)
+        with self.lock:
+            self.request_count += 1
+            self.reused += session.request_count > 1
+        logger.debug(
+            'reused keep-alive session for {} of {} requests'.format(
+                self.reused, self.request_count
+            )
+        )
+        return response
+
+
+session_manager = SessionManager()
@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import os
+import zlib
+
+from datetime import timedelta
+
+import zstandard
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import ProtectedError
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def compress(data):
+    '''return codec name and zstd compressed data'''
+    return 'zstd', zstandard.ZstdCompressor().compress(data)
+
+
+def get_decompressor(codec):
+    '''return incremental decompressor, zlib for rows stored before zstd'''
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj()
+
+
+class DatabaseBackend(object):
+
+    '''keep compressed page bodies in the database row'''
+
+    def write(self, digest, blob):
+        '''return PageBody fields holding blob'''
+        return {'data': blob}
+
+    def read(self, body, chunk_size):
+        '''yield compressed chunks of stored blob'''
+        data = bytes(body.data)
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+    def delete(self, path):
+        '''nothing to remove outside the deleted row'''
+
+
+class FileSystemBackend(object):
+
+    '''keep compressed page bodies in files with path stored in database'''
+
+    def __init__(self, root=None):
+        self.root = root or settings.PAGE_STORE_ROOT
+
+    def write(self, digest, blob):
+        '''write blob to file named by digest and return PageBody fields'''
+        path = os.path.join(digest[:2], digest[2:4], digest)
+        full_path = os.path.join(self.root, path)
+        if not os.path.exists(full_path):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path + '.tmp', 'wb') as f:
+                f.write(blob)
+            os.replace(full_path + '.tmp', full_path)
+        return {'path': path}
+
+    def read(self, body, chunk_size):
+        '''yield compressed chunks of stored file'''
+        with open(os.path.join(self.root, body.path), 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+
+    def delete(self, path):
+        '''remove file of deleted PageBody'''
+        try:
+            os.remove(os.path.join(self.root, path))
+        except FileNotFoundError:
+            pass
+
+
+BACKENDS = {
+    'database': DatabaseBackend,
+    'filesystem': FileSystemBackend,
+}
+
+
+class PageStore(object):
+
+    '''compressed and content deduplicated storage for page html'''
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, backend=None):
+        self._backend = backend
+
+    @property
+    def backend(self):
+        '''configured storage backend'''
+        if not self._backend:
+            self._backend = BACKENDS[settings.PAGE_STORE_BACKEND]()
+        return self._backend
+
+    def save(self, content):
+        '''store content once per digest and return PageBody'''
+        from .models import PageBody
+        digest = hashlib.sha256(content).hexdigest()
+        body = PageBody.objects.filter(digest=digest).first()
+        if body:
+            logger.debug('reusing page body {}'.format(digest))
+            return body
+        codec, blob = compress(content)
+        fields = self.backend.write(digest, blob)
+        try:
+            with transaction.atomic():
+                return PageBody.objects.create(
+                    digest=digest, codec=codec, size=len(content), **fields
+                )
+        except IntegrityError:
+            return PageBody.objects.get(digest=digest)
+
+    def stream(self, body):
+        '''yield decompressed chunks of stored page body'''
+        backend = DatabaseBackend()
+        if body.path:
+            backend = FileSystemBackend()
+        decompressor = get_decompressor(body.codec)
+        for chunk in backend.read(body, self.chunk_size):
+            yield decompressor.decompress(chunk)
+        if body.codec == 'zlib':
+            yield decompressor.flush()
+
+    def read(self, body):
+        '''return decompressed page body'''
+        return b''.join(self.stream(body))
+
+    def collect(self, age=None):
+        '''delete page bodies and files no page refers to, return count'''
+        from .models import PageBody
+        date_added = timezone.now() - timedelta(
+            seconds=settings.PAGE_BODY_GC_AGE if age is None else age
+        )
+        bodies = PageBody.objects.filter(
+            googlepage__isnull=True, date_added__lt=date_added
+        ).order_by('pk')
+        last = 0
+        count = 0
+        while True:
+            chunk = list(
+                bodies.filter(pk__gt=last).values_list('pk', 'path')[
+                    :settings.PAGE_STORE_CHUNK_SIZE
+                ]
+            )
+            if not chunk:
+                break
+            last = chunk[-1][0]
+            try:
+                with transaction.atomic():
+                    PageBody.objects.filter(
+                        pk__in=[pk for pk, _ in chunk]
+                    ).delete()
+            except (IntegrityError, ProtectedError) as e:
+                # a page started to reuse one of the bodies, next run
+                # collects the rest of this chunk
+                logger.warning('skipped page body chunk {}'.format(e))
+                continue
+            for _, path in chunk:
+                if path:
+                    FileSystemBackend().delete(path)
+            count += len(chunk)
+        logger.info('collected {} unused page bodies'.format(count))
+        return count
+
+    def backfill(self):
+        '''move html of pages stored before page bodies into page store'''
+        from .models import GooglePage
+        pages = GooglePage.objects.filter(body__isnull=True).exclude(
+            html=''
+        ).order_by('pk').only('pk', 'html')
+        count = 0
+        while True:
+            chunk = list(pages[:settings.PAGE_STORE_CHUNK_SIZE])
+            if not chunk:
+                break
+            with transaction.atomic():
+                for page in chunk:
+                    page.body = self.save(page.html.encode('utf-8'))
+                    page.html = ''
+                    page.save(update_fields=['body', 'html'])
+            count += len(chunk)
+            logger.info('moved html of {} google pages'.format(count))
+        return count
+
+
+page_store = PageStore()
@@ -1,58 +1,137 @@
 from celery import shared_task
 from celery.utils.log import get_task_logger
 
-from .models import Proxy
+from django.conf import settings
+from django.db.models import Case, When, Value, PositiveIntegerField
 
-logger = get_task_logger(__name__)
-
-
-@shared_task(bind=True)
-def _online_check_task(self, proxy):
-    '''call online check on proxy object'''
-    proxy.online_check()
+from .checks import BanProbe, OnlineChecker, chunks
+from .geo import geolocator
+from .jobs import jobs
+from .leases import leases
+from .loader import load_file
+from .models import Proxy, GoogleSearch, GooglePage, PageBody
+from .storage import page_store
+from .utils import expand_ids, minify_html, scrape_searches
 
-
-@shared_task(bind=True)
-def _google_ban_check_task(self, proxy):
-    '''call google ban check on proxy object'''
-    proxy.google_ban_check()
+logger = get_task_logger(__name__)
 
 
 @shared_task(bind=True)
-def _search_task(self, google_search):
-    '''call search on google search object'''
-    google_search.search()
+def _search_task(self, ranges, lane=None, enqueued=None, token=None):
+    '''scrape google searches for id ranges'''
+    ids = expand_ids(ranges)
+    try:
+        with jobs.heartbeat(ids, token):
+            searches = list(GoogleSearch.objects.filter(pk__in=ids))
+            if settings.USE_ASYNC_SCRAPER:
+                scrape_searches(searches)
+                return
+            for search in searches:
+                search.search()
+    finally:
+        if lane:
+            jobs.done(ids, lane, enqueued, token)
 
 
 @shared_task(bind=True)
-def online_check_task(self, proxies=None):
+def online_check_task(self, ranges=None):
     '''process online check tasks async'''
-    if not proxies:
-        proxies = Proxy.objects.all()
+    proxies = Proxy.objects.all()
+    if ranges:
+        proxies = proxies.filter(pk__in=expand_ids(ranges))
     logger.info(
         'starting online_check_task for {} proxies'.format(proxies.count())
     )
-    for proxy in proxies:
-        _online_check_task.delay(proxy)
+    OnlineChecker().check(proxies)
 
 
 @shared_task(bind=True)
-def google_ban_check_task(self, proxies=None):
+def google_ban_check_task(self, ranges=None):
     '''process google ban check tasks async'''
-    if not proxies:
-        proxies = Proxy.objects.all()
+    proxies = Proxy.objects.all()
+    if ranges:
+        proxies = proxies.filter(pk__in=expand_ids(ranges))
     logger.info(
         'starting google_ban_check_task for {} proxies'.format(proxies.count())
     )
-    for proxy in proxies:
-        _google_ban_check_task.delay(proxy)
+    BanProbe().check(proxies)
 
 
 @shared_task(bind=True)
-def search_task(self, searches):
-    '''process search tasks async'''
+def search_task(self, ranges, lane=None, batch=None):
+    '''submit searches for id ranges to job queue lane'''
+    ids = expand_ids(ranges)
+    logger.info('starting search_task for {} google searches'.format(len(ids)))
+    jobs.submit(ids, lane, batch)
+
+
+@shared_task(bind=True)
+def dispatch_jobs_task(self):
+    '''refill bulk lane and log job queue stats'''
+    jobs.dispatch()
+    logger.info('job queue stats {}'.format(jobs.stats()))
+
+
+@shared_task(bind=True)
+def sync_scraper_count_task(self):
+    '''copy live lease counts to proxy scraper count'''
+    proxies = dict(Proxy.objects.values_list('id', 'scraper_count'))
+    counts = leases.counts(proxies.keys())
+    changed = [
+        (pk, count) for pk, count in counts.items() if proxies[pk] != count
+    ]
+    for chunk in chunks(changed, settings.CHECK_CHUNK_SIZE):
+        Proxy.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+            scraper_count=Case(
+                *[When(pk=pk, then=Value(count)) for pk, count in chunk],
+                output_field=PositiveIntegerField()
+            )
+        )
     logger.info(
-        'starting search_task for {} google searches'.format(searches.count())
+        'synced scraper count for {} of {} proxies'.format(
+            len(changed), len(proxies)
+        )
     )
-    for search in searches:
-        _search_task.delay(search)
+
+
+@shared_task(bind=True)
+def minify_pages_task(self, ranges):
+    '''replace stored page bodies with minified html'''
+    pages = GooglePage.objects.filter(
+        pk__in=expand_ids(ranges), body__isnull=False
+    ).select_related('body')
+    for page in pages:
+        old_body = page.body
+        page.body = page_store.save(minify_html(page_store.read(old_body)))
+        page.save(update_fields=['body'])
+        PageBody.objects.filter(
+            pk=old_body.pk, googlepage__isnull=True
+        ).delete()
+    logger.info('minified {} google pages'.format(len(pages)))
+
+
+@shared_task(bind=True)
+def country_check_task(self, ranges=None):
+    '''set missing proxy countries from geoip database'''
+    proxies = Proxy.objects.all()
+    if ranges:
+        proxies = proxies.filter(pk__in=expand_ids(ranges))
+    geolocator.enrich(proxies)
+
+
+@shared_task(bind=True)
+def bulk_import_task(self, model_name, path):
+    '''stream csv file at path into model table'''
+    return load_file(model_name, path)
+
+
+@shared_task(bind=True)
+def collect_page_bodies_task(self):
+    '''delete page bodies and files left without pages'''
+    return page_store.collect()
+
+
+@shared_task(bind=True)
+def backfill_page_bodies_task(self):
+    '''move html of old pages into compressed page store'''
+    return page_store.backfill()
@@ -1,25 +1,90 @@
+import asyncio
+import cgi
 import logging
+import math
 import random
 import time
 
-from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlparse, urlunparse, parse_qs
 
 import htmlmin
 import requests
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, UnicodeDammit
+from lxml import etree, html
 
 from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .cache import search_cache
+from .checks import is_banned
+from .choices import PAGE_SIZES
+from .pool import proxy_pool
+from .scheduler import scheduler
+from .sessions import session_manager
+from .storage import page_store
 
 logger = logging.getLogger(__name__)
 
 
+def compress_ids(ids):
+    '''return sorted unique ids as list of inclusive [start, end] ranges'''
+    ranges = []
+    for pk in sorted(set(ids)):
+        if ranges and ranges[-1][1] + 1 == pk:
+            ranges[-1][1] = pk
+        else:
+            ranges.append([pk, pk])
+    return ranges
+
+
+def expand_ids(ranges):
+    '''return ids from list of inclusive [start, end] ranges'''
+    ids = []
+    for start, end in ranges:
+        ids.extend(range(start, end + 1))
+    return ids
+
+
+def minify_html(content):
+    '''return minified html bytes'''
+    return htmlmin.minify(content.decode('utf-8', 'replace')).encode('utf-8')
+
+
+def set_query_param(url, name, value):
+    '''return url with query parameter set to value'''
+    parts = urlparse(url)
+    params = parse_qs(parts.query, keep_blank_values=True)
+    params[name] = [str(value)]
+    return urlunparse(parts._replace(query=urlencode(params, doseq=True)))
+
+
+def weighted_choice(items, weights):
+    '''return random item with probability proportional to weight or None'''
+    point = random.uniform(0, sum(weights))
+    for item, weight in zip(items, weights):
+        point -= weight
+        if point <= 0:
+            return item
+    if items:
+        return items[-1]
+
+
+def get_text(response):
+    '''return response html decoded by header charset, meta or detection'''
+    _, params = cgi.parse_header(response.headers.get('content-type', ''))
+    encodings = [params['charset']] if 'charset' in params else []
+    dammit = UnicodeDammit(response.content, encodings, is_html=True)
+    return dammit.unicode_markup or ''
+
+
 class GoogleParser(object):
 
     '''parse response from google'''
 
     def __init__(self, response):
-        self.soup = BeautifulSoup(response.content, 'html.parser')
+        self.soup = BeautifulSoup(get_text(response), 'html.parser')
 
     def parse_links(self):
         '''return result nodes that contain snippet node'''
@@ -53,10 +118,6 @@ class GoogleParser(object):
         return 'https://www.google.com' + \
             self.soup.find('span', string='Next').find_previous('a')['href']
 
-    def get_html(self):
-        '''return minifyfied html from soup'''
-        return htmlmin.minify(str(self.soup))
-
     def get_links(self):
         '''return parsed link dictionaries'''
         links = []
@@ -68,10 +129,69 @@ class GoogleParser(object):
         '''return next page url or None'''
         try:
             return self.parse_next_page()
-        except IndexError:
+        except (AttributeError, IndexError):
             pass
 
 
+def has_class(name):
+    '''return xpath predicate matching elements with css class name'''
+    return "contains(concat(' ', normalize-space(@class), ' '), " \
+        "' {} ')".format(name)
+
+
+class LxmlGoogleParser(GoogleParser):
+
+    '''parse response from google with lxml xpath queries'''
+
+    links_path = etree.XPath(
+        '//*[{}]//*[{}]'.format(has_class('g'), has_class('s'))
+    )
+    title_path = etree.XPath('(.//a)[1]')
+    snippet_path = etree.XPath('(.//*[{}])[1]'.format(has_class('st')))
+    next_path = etree.XPath("//span[not(*) and .='Next']")
+    previous_path = etree.XPath('(preceding::a | ancestor::a)[last()]')
+
+    def __init__(self, response):
+        self.tree = html.fromstring(get_text(response))
+
+    def parse_links(self):
+        '''return result nodes that contain snippet node'''
+        return [node.getparent() for node in self.links_path(self.tree)]
+
+    def parse_url(self, node):
+        '''return title url from result node'''
+        href = self.title_path(node)[0].attrib['href']
+        try:
+            return parse_qs(urlparse(href).query)['q'][0]
+        except KeyError:
+            return href
+
+    def parse_title(self, node):
+        '''return title text from result node'''
+        return self.title_path(node)[0].text_content()
+
+    def parse_snippet(self, node):
+        '''return snippet text from result node'''
+        return self.snippet_path(node)[0].text_content()
+
+    def parse_next_page(self):
+        '''return next page url or None'''
+        span = self.next_path(self.tree)[0]
+        return 'https://www.google.com' + \
+            self.previous_path(span)[0].attrib['href']
+
+
+PARSERS = {
+    'html.parser': GoogleParser,
+    'lxml': LxmlGoogleParser,
+}
+
+
+def get_parser(response):
+    '''return parser for response using configured backend'''
+    return PARSERS[settings.PARSER_BACKEND](response)
+
+
 class GoogleScraper(object):
 
     '''follow next page and extract links'''
@@ -85,6 +205,9 @@ class GoogleScraper(object):
         self.search = search
         self.user_agent = user_agent
         self.proxy = proxy
+        self.request_count = 0
+        self.pages = []
+        self.page_size = search.get_page_size()
 
     def sleep(self, seconds):
         '''sleep n seconds'''
@@ -93,17 +216,22 @@ class GoogleScraper(object):
 
     def update_proxy(self):
         '''update proxy for instance'''
-        from .models import Proxy
         old_proxy = self.proxy
-        self.proxy = Proxy.get_proxy()
+        self.proxy = proxy_pool.get_proxy()
         logging.info(
             'switching proxy from {} to {}'.format(old_proxy, self.proxy)
         )
-        self.sleep(
-            random.uniform(
-                settings.MIN_REQUEST_SLEEP, settings.MAX_REQUEST_SLEEP
+
+    def wait(self):
+        '''sleep until next request slot is available'''
+        if self.proxy:
+            self.sleep(scheduler.reserve(self.proxy))
+        elif self.request_count:
+            self.sleep(
+                random.uniform(
+                    settings.MIN_RETRY_SLEEP, settings.MAX_RETRY_SLEEP
+                )
             )
-        )
 
     def get_request_params(self):
         '''return request call parameters to be unpacked.'''
@@ -115,22 +243,30 @@ class GoogleScraper(object):
             logging.debug('not using user agent')
         if self.proxy:
             logging.info('using proxy {}'.format(self.proxy))
-            params['proxies'] = {
-                'http': 'http://{}:{}'.format(self.proxy.host, self.proxy.port)
-            }
+            params['proxies'] = self.proxy.get_request_proxies()
         else:
             logging.debug('not using proxy')
         return params
 
     def get_response(self):
         '''fetch http response for url'''
+        self.request_count += 1
         if self.proxy:
-            self.proxy.register()
-            response = requests.get(**self.get_request_params())
-            self.proxy.unregister()
-            self.proxy.set_online()
+            lease = self.proxy.register()
+            try:
+                response = session_manager.request(
+                    self.proxy, self.user_agent, **self.get_request_params()
+                )
+            finally:
+                self.proxy.unregister(lease)
+            proxy_pool.set_online(self.proxy)
+            proxy_pool.set_latency(
+                self.proxy, response.elapsed.total_seconds()
+            )
         else:
-            response = requests.get(**self.get_request_params())
+            response = session_manager.request(
+                None, self.user_agent, **self.get_request_params()
+            )
         logging.info('got response from url {}'.format(self.url))
         return response
 
@@ -142,80 +278,120 @@ class GoogleScraper(object):
             logging.warning('connection failed {}'.format(e))
         except requests.Timeout as e:
             logging.warning('connection timeout {}'.format(e))
+        session_manager.discard(self.proxy, self.user_agent)
         if self.proxy:
-            self.proxy.unset_online()
+            proxy_pool.unset_online(self.proxy)
             self.update_proxy()
         logging.warning('failed to get response from url {}'.format(self.url))
 
     def handle_status_code(self):
-        '''return http response or None if status code not equal to 200'''
-        if self.response.status_code == 200:
+        '''return http response or None if google refused or banned it'''
+        if not is_banned(self.response):
             logging.info('status code 200 for {}'.format(self.url))
             if self.proxy:
-                self.proxy.unset_google_ban()
+                proxy_pool.unset_google_ban(self.proxy)
             return self.response
         logging.warning(
-            'bad status code {} for {}'.format(
+            'banned with status code {} for {}'.format(
                 self.response.status_code, self.url
             )
         )
         if self.proxy:
-            self.proxy.set_google_ban()
+            proxy_pool.set_google_ban(self.proxy)
             self.update_proxy()
 
+    def handle_parser(self):
+        '''return http response or None if its body cannot be parsed'''
+        try:
+            self.parser = get_parser(self.response)
+        except etree.ParserError as e:
+            logging.warning(
+                'failed to parse response from {} {}'.format(self.url, e)
+            )
+            return
+        return self.response
+
+    def try_request(self):
+        '''perform single http request and return valid response or None'''
+        self.response = self.handle_response()
+        if self.response:
+            self.response = self.handle_status_code()
+        if self.response:
+            self.response = self.handle_parser()
+        return self.response
+
     def do_request(self):
         '''perform http request and handle exceptions'''
         for i in range(settings.MAX_RETRY):
-            self.response = self.handle_response()
-            if not self.response:
-                logging.warning('retrying for {} time'.format(i + 1))
-                continue
-            self.response = self.handle_status_code()
-            if not self.response:
-                logging.warning('retrying for {} time'.format(i + 1))
-                continue
-            self.parser = GoogleParser(self.response)
-            break
+            self.wait()
+            if self.try_request():
+                break
+            logging.warning('retrying for {} time'.format(i + 1))
 
     def get_links(self):
         '''get link array from parser and adjust result count'''
         self.links = self.parser.get_links()
         self.page_result_count = len(self.links)
+        self.search_result_count += self.page_result_count
 
     def get_end(self):
         '''return end result index'''
         return self.start + self.page_result_count
 
+    def get_html(self):
+        '''return page html bytes for configured capture mode'''
+        if settings.PAGE_CAPTURE_MODE == 'minify':
+            return minify_html(self.response.content)
+        return self.response.content
+
     def create_page(self):
         '''create GooglePage entry in database'''
         from .models import GooglePage
         self.page = GooglePage.objects.create(
             search=self.search,
             url=self.url,
-            html=self.parser.get_html(),
+            body=page_store.save(self.get_html()),
             result_count=self.page_result_count,
             start=self.start,
             end=self.get_end(),
             next_page=self.parser.get_next_page()
         )
+        self.pages.append(self.page.pk)
         logging.debug('created google page {}'.format(self.page))
 
     def create_links(self):
-        '''create GoogleLink entries in database'''
+        '''create GoogleLink entries in database with single insert'''
         from .models import GoogleLink
         links = []
         for i, link_params, in enumerate(self.links):
-            link_params.update({'page': self.page, 'rank': self.start + i})
-            link = GoogleLink.objects.create(**link_params)
-            logging.debug('created google link {}'.format(link))
-            links.append(link)
-        self.links = links
+            link_params.update({
+                'page': self.page, 'search': self.search,
+                'rank': self.start + i
+            })
+            links.append(GoogleLink(**link_params))
+        self.links = GoogleLink.objects.bulk_create(links)
         logging.info(
             'created {} google links for google page {}'.format(
                 len(self.links), self.page
             )
         )
 
+    def save_page(self):
+        '''create GooglePage and its GoogleLink entries in one transaction'''
+        try:
+            with transaction.atomic():
+                self.create_page()
+                self.create_links()
+        except IntegrityError:
+            logging.info(
+                'page starting at {} already stored for query {}'.format(
+                    self.start, self.search
+                )
+            )
+            self.page = self.search.googlepage_set.get(start=self.start)
+            self.page_result_count = self.page.result_count
+            self.search_result_count = self.page.end - 1
+
     def is_request_failed(self):
         '''check for valid response'''
         if self.response:
@@ -231,32 +407,187 @@ class GoogleScraper(object):
         self.success = True
         return True
 
+    def is_depth_reached(self):
+        '''check if search collected the wanted number of results'''
+        depth = self.search.depth
+        if not depth or self.search_result_count < depth:
+            return
+        logging.debug('reached depth for query {}'.format(self.search))
+        self.success = True
+        return True
+
+    def is_truncated(self):
+        '''check if google returned much less results than requested'''
+        return self.page_result_count < \
+            self.page_size * settings.PAGE_TRUNCATION_RATIO
+
+    def reduce_page_size(self):
+        '''switch next page url to next smaller page size'''
+        sizes = [size for size in PAGE_SIZES if size < self.page_size]
+        if not sizes:
+            return
+        logging.info(
+            'reducing page size from {} to {} for query {}'.format(
+                self.page_size, sizes[-1], self.search
+            )
+        )
+        self.page_size = sizes[-1]
+        self.url = set_query_param(self.url, 'num', self.page_size)
+
+    def get_max_page(self):
+        '''return page limit for search'''
+        if self.search.depth:
+            return math.ceil(self.search.depth / PAGE_SIZES[0])
+        return settings.MAX_PAGE
+
+    def resume(self):
+        '''continue after last stored page and return count of pages left'''
+        pages = self.search.googlepage_set.order_by('-start')
+        self.page = pages.first()
+        if not self.page:
+            return self.get_max_page()
+        self.start = self.page.start
+        self.search_result_count = self.page.end - 1
+        self.page_result_count = self.page.result_count
+        self.request_count = self.search.request_count
+        query = parse_qs(urlparse(self.page.url).query)
+        self.page_size = int(query.get('num', [PAGE_SIZES[0]])[0])
+        logging.info(
+            'resuming query {} after result {}'.format(
+                self.search, self.search_result_count
+            )
+        )
+        if self.is_last_page() or self.is_depth_reached():
+            return 0
+        self.update_loop()
+        return max(0, self.get_max_page() - pages.count())
+
     def update_loop(self):
         '''update instance with new values'''
         self.url = self.page.next_page
-        self.search_result_count += self.page_result_count
         self.start = self.get_end()
         self.success = True
-        self.sleep(
-            random.uniform(settings.MIN_RETRY_SLEEP, settings.MAX_RETRY_SLEEP)
-        )
+        if self.is_truncated():
+            self.reduce_page_size()
 
     def update_search(self):
         '''update search record with new values'''
-        self.search.set_result_count(self.search_result_count)
-        self.search.set_success(self.success)
+        self.search.set_results(
+            self.search_result_count, self.success, self.request_count
+        )
+
+    def defer_minify(self):
+        '''queue stored pages for minification in deferred capture mode'''
+        from .tasks import minify_pages_task
+        if settings.PAGE_CAPTURE_MODE != 'deferred' or not self.pages:
+            return
+        minify_pages_task.delay(compress_ids(self.pages))
 
     def scrape(self):
         '''main scrape call'''
         logging.debug('scraping for query {}'.format(self.search))
-        for _ in range(settings.MAX_PAGE):
+        for _ in range(self.resume()):
             self.do_request()
             if self.is_request_failed():
                 break
             self.get_links()
-            self.create_page()
-            self.create_links()
-            if self.is_last_page():
+            self.save_page()
+            if self.is_last_page() or self.is_depth_reached():
                 break
             self.update_loop()
         self.update_search()
+        search_cache.store(self.search)
+        self.defer_minify()
+
+
+class AsyncGoogleScraper(GoogleScraper):
+
+    '''google scraper that sleeps without blocking the event loop'''
+
+    def __init__(self, search, user_agent=None, proxy=None, loop=None,
+                 executor=None):
+        super().__init__(search, user_agent, proxy)
+        self.loop = loop or asyncio.get_event_loop()
+        self.executor = executor
+        self.pending_sleep = 0
+
+    def sleep(self, seconds):
+        '''defer sleep until flush_sleep is awaited'''
+        logging.debug('deferring sleep for {} seconds'.format(seconds))
+        self.pending_sleep += seconds
+
+    async def flush_sleep(self):
+        '''sleep for deferred seconds on the event loop'''
+        seconds, self.pending_sleep = self.pending_sleep, 0
+        if seconds:
+            await asyncio.sleep(seconds)
+
+    async def run(self, func, *args):
+        '''run blocking http or database call in executor'''
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    async def do_request(self):
+        '''perform http request and handle exceptions'''
+        for i in range(settings.MAX_RETRY):
+            await self.run(self.wait)
+            await self.flush_sleep()
+            if await self.run(self.try_request):
+                break
+            logging.warning('retrying for {} time'.format(i + 1))
+
+    async def scrape(self):
+        '''main scrape coroutine'''
+        logging.debug('scraping for query {}'.format(self.search))
+        for _ in range(await self.run(self.resume)):
+            await self.do_request()
+            if self.is_request_failed():
+                break
+            self.get_links()
+            await self.run(self.save_page)
+            if self.is_last_page() or self.is_depth_reached():
+                break
+            self.update_loop()
+        await self.run(self.update_search)
+        await self.run(search_cache.store, self.search)
+        await self.run(self.defer_minify)
+
+
+def scrape_searches(searches):
+    '''scrape google searches concurrently in a single event loop'''
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executor = ThreadPoolExecutor(
+        min(settings.SCRAPER_THREADS, settings.SCRAPER_CONCURRENCY)
+    )
+    semaphore = asyncio.Semaphore(settings.SCRAPER_CONCURRENCY)
+
+    async def scrape(search):
+        async with semaphore:
+            if await loop.run_in_executor(
+                executor, search_cache.restore, search
+            ):
+                return
+            params = await loop.run_in_executor(
+                executor, search.get_scraper_params
+            )
+            scraper = AsyncGoogleScraper(
+                *params, loop=loop, executor=executor
+            )
+            await scraper.scrape()
+
+    try:
+        results = loop.run_until_complete(
+            asyncio.gather(
+                *[scrape(search) for search in searches],
+                return_exceptions=True
+            )
+        )
+        for search, result in zip(searches, results):
+            if isinstance(result, Exception):
+                logging.error(
+                    'scraping for query {} failed {}'.format(search, result)
+                )
+    finally:
+        executor.shutdown()
+        loop.close()
+        proxy_pool.flush()
@@ -1,10 +1,47 @@
-from django.http import HttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+)
 from django.shortcuts import get_object_or_404
 
+from .export import export_links, get_content_type
+from .jobs import jobs
 from .models import GooglePage
+from .storage import page_store
 
 
 def html_view(request, pk):
     '''display stored html as page'''
-    html_response = get_object_or_404(GooglePage, pk=pk)
+    html_response = get_object_or_404(
+        GooglePage.objects.select_related('body'), pk=pk
+    )
+    if html_response.body:
+        return StreamingHttpResponse(
+            page_store.stream(html_response.body), content_type='text/html'
+        )
     return HttpResponse(html_response.html)
+
+
+@staff_member_required
+def jobs_view(request):
+    '''display search job queue depth and wait times'''
+    return JsonResponse(jobs.stats())
+
+
+@staff_member_required
+def export_view(request, export_format):
+    '''stream google links of optional comma separated search ids'''
+    search_ids = [
+        int(pk) for pk in request.GET.get('search', '').split(',')
+        if pk.isdigit()
+    ]
+    try:
+        chunks = export_links(export_format, search_ids)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    response = StreamingHttpResponse(
+        chunks, content_type=get_content_type(export_format)
+    )
+    response['Content-Disposition'] = \
+        'attachment; filename="google_links.{}"'.format(export_format)
+    return response